@@ -1,40 +1,89 @@
 import random
 import numpy
 import math
+import concurrent.futures
+from collections import deque
 import matplotlib.pyplot as plt
+from scipy import stats
 
+# random stream that draws rayleigh and uniform times by inverse transform of its uniforms U,
+# or of 1 - U for the antithetic run of a pair, so the two runs get negatively correlated times
+class InverseStream:
+	def __init__(self, rng, antithetic = False):
+		self.rng = rng
+		self.antithetic = antithetic
+
+	def uniforms(self, size):
+		u = self.rng.random(size)
+		if (self.antithetic):
+			return 1 - u
+		return u
+
+	def rayleigh(self, sigma, size):
+		return sigma * numpy.sqrt(-2 * numpy.log1p(-self.uniforms(size)))
+
+	def uniform(self, a, b, size):
+		return a + (b - a) * self.uniforms(size)
+
+# times are drawn in blocks of block_size values, one numpy call per block
 class Generator:
-	def __init__(self, sigma):
+	def __init__(self, sigma, block_size = 1024):
 		assert(sigma >= 0)
 		self.scale = sigma
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		nparray = numpy.random.rayleigh(self.scale, 1)
-		return nparray[0]
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.rayleigh(self.scale, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class Operator:
-	def __init__(self, a, b):
+	def __init__(self, a, b, block_size = 1024):
 		assert(a >= 0 and b >= 0 and a < b)
 		self.busy = False
 		self.low = a
 		self.high = b
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		return random.uniform(self.low, self.high)
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.uniform(self.low, self.high, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class System:
-	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [4], operators_conf_array = [[0, 2]]):
+	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [4], operators_conf_array = [[0, 2]], block_size = 1024, seed = None):
 		assert(start_time >= 0 and end_time >= 0 and end_time > start_time)
 		self.start_time = start_time
 		self.end_time = end_time
+		self.block_size = block_size
+		if (isinstance(seed, numpy.random.SeedSequence)):
+			self.seed_sequence = seed
+		else:
+			self.seed_sequence = numpy.random.SeedSequence(seed)
 
 		assert(len(generators_conf_array) != 0)
 		self.generators_number = len(generators_conf_array)
-		self.generators = [Generator(generators_conf_array[i]) for i in range (self.generators_number)]
+		self.generators = [Generator(generators_conf_array[i], self.block_size) for i in range (self.generators_number)]
 
 		assert(len(operators_conf_array) != 0)
 		self.operators_number = len(operators_conf_array)
-		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1]) for i in range(self.operators_number)]
+		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1], self.block_size) for i in range(self.operators_number)]
 
 		self.queue_length = 0
 		self.max_queue_length = 0
@@ -44,6 +93,7 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
 
 	def reset(self):
 		self.queue_length = 0
@@ -54,9 +104,21 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
 		for op in self.operators:
 			op.busy = False
 
+	# every generator and operator draws from its own stream spawned from seed
+	# antithetic False or True gives inverse transform streams of U or 1 - U (InverseStream)
+	def seed_streams(self, seed, antithetic = None):
+		streams = [numpy.random.default_rng(child) for child in seed.spawn(self.generators_number + self.operators_number)]
+		if (antithetic is not None):
+			streams = [InverseStream(stream, antithetic) for stream in streams]
+		for i in range(self.generators_number):
+			self.generators[i].set_rng(streams[i])
+		for i in range(self.operators_number):
+			self.operators[i].set_rng(streams[self.generators_number + i])
+
 	def add_event(self, event: list):
 		i = 0
 		while i < len(self.events) and self.events[i][0] <= event[0]:
@@ -86,31 +148,80 @@ class System:
 		while i < self.operators_number and self.operators[i].busy:
 			i += 1
 		if i != self.operators_number:
-			self.queue_length -= 1
-			self.operators[i].busy = True
-			self.add_event([event[0] + self.operators[i].generate_time(), 'operator', i])
-			self.started_processing += 1
-			self.avg_waiting_time += event[3]
-			if (event[3] > self.max_waiting_time):
-				self.max_waiting_time = event[3]
+			self.take_client(i, event[0], event[3])
 		else:
-			j = 0
-			while j < len(self.events) and self.events[j][1] != 'operator':
-				j += 1
-			self.add_event([self.events[j][0], 'client', event[2], event[3] + self.events[j][0] - event[0]])
-		if (event[3] == 0):
-			self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
-			self.generated += 1
-			self.queue_length += 1
-			if (self.queue_length > self.max_queue_length):
-				self.max_queue_length = self.queue_length
+			# all operators are busy, the client waits in line
+			self.waiting.append(event)
+		self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
+		self.generated += 1
+		self.queue_length += 1
+		if (self.queue_length > self.max_queue_length):
+			self.max_queue_length = self.queue_length
+
+	def take_client(self, i, time, waiting_time):
+		self.queue_length -= 1
+		self.operators[i].busy = True
+		self.add_event([time + self.operators[i].generate_time(), 'operator', i])
+		self.started_processing += 1
+		self.avg_waiting_time += waiting_time
+		if (waiting_time > self.max_waiting_time):
+			self.max_waiting_time = waiting_time
 
 	def finish_operate(self, event):
 		self.operators[event[2]].busy = False
 		self.processed += 1
+		if (len(self.waiting) > 0 and event[0] < self.end_time):
+			client = self.waiting.popleft()
+			self.take_client(event[2], event[0], event[0] - client[0])
+
+
+# half width of the Student t confidence interval of the mean of values
+def confidence_half_width(values, confidence = 0.95):
+	n = len(values)
+	if (n < 2):
+		return math.inf
+	mean = sum(values) / n
+	variance = sum([(value - mean) ** 2 for value in values]) / (n - 1)
+	return stats.t(df = n - 1).ppf((1 + confidence) / 2) * math.sqrt(variance / n)
+
+# a seed that spawns the same children as seed did before it spawned any
+def seed_copy(seed):
+	return numpy.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key, pool_size = seed.pool_size)
+
+# replications with the given seeds one after another, statistics of every replication
+# with antithetic every replication is a pair of runs with the same seed driven by U and 1 - U
+# and its statistics are the means of the two runs
+def run_replications(model, seeds, antithetic = False):
+	runs = []
+	for seed in seeds:
+		pair = []
+		for inverse in ((False, True) if antithetic else (None,)):
+			model.seed_streams(seed_copy(seed), inverse)
+			model.modeling()
+			pair.append((model.queue_length, model.max_queue_length, model.generated, model.started_processing,
+				model.processed, model.avg_waiting_time, model.max_waiting_time))
+			model.reset()
+		runs.append(pair[0] if len(pair) == 1 else tuple(sum(values) / len(pair) for values in zip(*pair)))
+	return runs
+
+# replications are split into one contiguous chunk per worker and run in a process pool
+# every replication keeps its own seed, so the result does not depend on the number of workers
+def parallel_replications(model, seeds, workers = 1, antithetic = False):
+	if (workers <= 1 or len(seeds) <= 1):
+		return run_replications(model, seeds, antithetic)
+	size = math.ceil(len(seeds) / workers)
+	chunks = [seeds[i:i + size] for i in range(0, len(seeds), size)]
+	with concurrent.futures.ProcessPoolExecutor(max_workers = len(chunks)) as pool:
+		return [value for chunk in pool.map(run_replications, [model] * len(chunks), chunks, [antithetic] * len(chunks)) for value in chunk]
 
+# with half_width replications are added times at a time until the half width of the confidence interval
+# of the mean waiting time is below half_width or there are max_times of them
+def more_replications(model, runs, times, workers, half_width, max_times, waiting_time, antithetic = False):
+	while (half_width is not None and len(runs) < max_times and confidence_half_width([waiting_time(run) for run in runs]) > half_width):
+		runs += parallel_replications(model, model.seed_sequence.spawn(min(times, max_times - len(runs))), workers, antithetic)
+	return runs
 
-def getStat(model, times):
+def getStat(model, times, workers = 1, half_width = None, max_times = 100, antithetic = False):
 	queue_length = 0
 	max_queue_length = 0
 	generated = 0
@@ -119,16 +230,17 @@ def getStat(model, times):
 	avg_waiting_time = 0
 	max_waiting_time = 0
 
-	for i in range(times):
-		model.modeling()
-		queue_length += model.queue_length
-		max_queue_length += model.max_queue_length
-		generated += model.generated
-		started_processing += model.started_processing
-		processed += model.processed
-		avg_waiting_time += model.avg_waiting_time
-		max_waiting_time += model.max_waiting_time
-		model.reset()
+	runs = parallel_replications(model, model.seed_sequence.spawn(times), workers, antithetic)
+	runs = more_replications(model, runs, times, workers, half_width, max_times, lambda run: run[5], antithetic)
+	times = len(runs)
+	for stat in runs:
+		queue_length += stat[0]
+		max_queue_length += stat[1]
+		generated += stat[2]
+		started_processing += stat[3]
+		processed += stat[4]
+		avg_waiting_time += stat[5]
+		max_waiting_time += stat[6]
 
 	queue_length /= times
 	max_queue_length /= times
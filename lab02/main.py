@@ -1,41 +1,70 @@
 import random
 import numpy
 import math
+from collections import deque
 import matplotlib.pyplot as plt
 from prettytable import PrettyTable
+from replications import InverseStream, parallel_replications, more_replications
 
+# times are drawn in blocks of block_size values, one numpy call per block
 class Generator:
-	def __init__(self, sigma):
+	def __init__(self, sigma, block_size = 1024):
 		assert(sigma >= 0)
 		self.scale = sigma
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		nparray = numpy.random.rayleigh(self.scale, 1)
-		return nparray[0]
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.rayleigh(self.scale, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class Operator:
-	def __init__(self, a, b):
+	def __init__(self, a, b, block_size = 1024):
 		assert(a >= 0 and b >= 0 and a < b)
 		self.busy = False
 		self.low = a
 		self.high = b
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		return random.uniform(self.low, self.high)
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.uniform(self.low, self.high, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class System:
-	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [4], operators_conf_array = [[0, 2]]):
+	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [4], operators_conf_array = [[0, 2]], block_size = 1024, seed = None):
 		assert(start_time >= 0 and end_time >= 0 and end_time > start_time)
 		self.start_time = start_time
 		self.end_time = end_time
+		self.block_size = block_size
+		if (isinstance(seed, numpy.random.SeedSequence)):
+			self.seed_sequence = seed
+		else:
+			self.seed_sequence = numpy.random.SeedSequence(seed)
 
 		assert(len(generators_conf_array) != 0)
 		self.generators_number = len(generators_conf_array)
-		self.generators = [Generator(generators_conf_array[i]) for i in range (self.generators_number)]
+		self.generators = [Generator(generators_conf_array[i], self.block_size) for i in range (self.generators_number)]
 
 		assert(len(operators_conf_array) != 0)
 		self.operators_number = len(operators_conf_array)
-		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1]) for i in range(self.operators_number)]
+		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1], self.block_size) for i in range(self.operators_number)]
 
 		self.queue_length = 0
 		self.max_queue_length = 0
@@ -45,6 +74,7 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
 
 	def reset(self):
 		self.queue_length = 0
@@ -55,9 +85,21 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
 		for op in self.operators:
 			op.busy = False
 
+	# every generator and operator draws from its own stream spawned from seed
+	# antithetic False or True gives inverse transform streams of U or 1 - U (InverseStream)
+	def seed_streams(self, seed, antithetic = None):
+		streams = [numpy.random.default_rng(child) for child in seed.spawn(self.generators_number + self.operators_number)]
+		if (antithetic is not None):
+			streams = [InverseStream(stream, antithetic) for stream in streams]
+		for i in range(self.generators_number):
+			self.generators[i].set_rng(streams[i])
+		for i in range(self.operators_number):
+			self.operators[i].set_rng(streams[self.generators_number + i])
+
 	def add_event(self, event: list):
 		i = 0
 		while i < len(self.events) and self.events[i][0] <= event[0]:
@@ -87,38 +129,35 @@ class System:
 		while i < self.operators_number and self.operators[i].busy:
 			i += 1
 		if i != self.operators_number:
-			self.queue_length -= 1
-			self.operators[i].busy = True
-			self.add_event([event[0] + self.operators[i].generate_time(), 'operator', i])
-			self.started_processing += 1
-			self.avg_waiting_time += event[3]
-			if (event[3] > self.max_waiting_time):
-				self.max_waiting_time = event[3]
+			self.take_client(i, event[0], event[3])
 		else:
-			j = 0
-			while j < len(self.events) and self.events[j][1] != 'operator':
-				j += 1
-			self.add_event([self.events[j][0], 'client', event[2], event[3] + self.events[j][0] - event[0]])
-		if (event[3] == 0):
-			self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
-			self.generated += 1
-			self.queue_length += 1
-			if (self.queue_length > self.max_queue_length):
-				self.max_queue_length = self.queue_length
+			# all operators are busy, the client waits in line
+			self.waiting.append(event)
+		self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
+		self.generated += 1
+		self.queue_length += 1
+		if (self.queue_length > self.max_queue_length):
+			self.max_queue_length = self.queue_length
+
+	def take_client(self, i, time, waiting_time):
+		self.queue_length -= 1
+		self.operators[i].busy = True
+		self.add_event([time + self.operators[i].generate_time(), 'operator', i])
+		self.started_processing += 1
+		self.avg_waiting_time += waiting_time
+		if (waiting_time > self.max_waiting_time):
+			self.max_waiting_time = waiting_time
 
 	def finish_operate(self, event):
 		self.operators[event[2]].busy = False
 		self.processed += 1
+		if (len(self.waiting) > 0 and event[0] < self.end_time):
+			client = self.waiting.popleft()
+			self.take_client(event[2], event[0], event[0] - client[0])
 
-def getStat(model, times):
-	waiting_time_arr = []
-
-	for i in range(times):
-		model.modeling()
-		waiting_time_arr.append(model.avg_waiting_time)
-		model.reset()
-
-	return (waiting_time_arr)
+def getStat(model, times, workers = 1, half_width = None, max_times = 100, antithetic = False):
+	runs = parallel_replications(model, model.seed_sequence.spawn(times), workers, antithetic)
+	return more_replications(model, runs, times, workers, half_width, max_times, lambda run: run, antithetic)
 
 def printtable(table, times):
 	pt = PrettyTable()
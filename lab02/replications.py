@@ -0,0 +1,67 @@
+import numpy
+import math
+import concurrent.futures
+from scipy import stats
+
+# random stream that draws rayleigh and uniform times by inverse transform of its uniforms U,
+# or of 1 - U for the antithetic run of a pair, so the two runs get negatively correlated times
+class InverseStream:
+	def __init__(self, rng, antithetic = False):
+		self.rng = rng
+		self.antithetic = antithetic
+
+	def uniforms(self, size):
+		u = self.rng.random(size)
+		if (self.antithetic):
+			return 1 - u
+		return u
+
+	def rayleigh(self, sigma, size):
+		return sigma * numpy.sqrt(-2 * numpy.log1p(-self.uniforms(size)))
+
+	def uniform(self, a, b, size):
+		return a + (b - a) * self.uniforms(size)
+
+# half width of the Student t confidence interval of the mean of values
+def confidence_half_width(values, confidence = 0.95):
+	n = len(values)
+	if (n < 2):
+		return math.inf
+	mean = sum(values) / n
+	variance = sum([(value - mean) ** 2 for value in values]) / (n - 1)
+	return stats.t(df = n - 1).ppf((1 + confidence) / 2) * math.sqrt(variance / n)
+
+# a seed that spawns the same children as seed did before it spawned any
+def seed_copy(seed):
+	return numpy.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key, pool_size = seed.pool_size)
+
+# replications with the given seeds one after another, average waiting time of every replication
+# with antithetic every value is the mean of a pair of runs with the same seed driven by U and 1 - U
+def run_replications(model, seeds, antithetic = False):
+	waiting_time_arr = []
+	for seed in seeds:
+		pair = []
+		for inverse in ((False, True) if antithetic else (None,)):
+			model.seed_streams(seed_copy(seed), inverse)
+			model.modeling()
+			pair.append(model.avg_waiting_time)
+			model.reset()
+		waiting_time_arr.append(sum(pair) / len(pair))
+	return waiting_time_arr
+
+# replications are split into one contiguous chunk per worker and run in a process pool
+# every replication keeps its own seed, so the result does not depend on the number of workers
+def parallel_replications(model, seeds, workers = 1, antithetic = False):
+	if (workers <= 1 or len(seeds) <= 1):
+		return run_replications(model, seeds, antithetic)
+	size = math.ceil(len(seeds) / workers)
+	chunks = [seeds[i:i + size] for i in range(0, len(seeds), size)]
+	with concurrent.futures.ProcessPoolExecutor(max_workers = len(chunks)) as pool:
+		return [value for chunk in pool.map(run_replications, [model] * len(chunks), chunks, [antithetic] * len(chunks)) for value in chunk]
+
+# with half_width replications are added times at a time until the half width of the confidence interval
+# of the mean waiting time is below half_width or there are max_times of them
+def more_replications(model, runs, times, workers, half_width, max_times, waiting_time, antithetic = False):
+	while (half_width is not None and len(runs) < max_times and confidence_half_width([waiting_time(run) for run in runs]) > half_width):
+		runs += parallel_replications(model, model.seed_sequence.spawn(min(times, max_times - len(runs))), workers, antithetic)
+	return runs
@@ -0,0 +1,49 @@
+import sqlite3
+import hashlib
+import json
+import time
+
+# key of params (a json-like dict of everything a result depends on), the same params give the same key
+def cache_key(params):
+	return hashlib.sha256(json.dumps(params, sort_keys = True, default = int).encode()).hexdigest()
+
+# results of model runs kept in an sqlite file between sessions, looked up by the key of their params.
+# when the stored results take more than max_bytes the ones used longest ago are evicted
+class Cache:
+	def __init__(self, path, max_bytes = 64 * 1024 * 1024):
+		self.path = path
+		self.max_bytes = max_bytes
+		# several processes of a pool may use the file at once, they wait for each other's writes
+		self.connection = sqlite3.connect(path, timeout = 60)
+		with self.connection:
+			self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, size INTEGER, used INTEGER)")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+	# stored result of params or None
+	def get(self, params):
+		key = cache_key(params)
+		with self.connection:
+			row = self.connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+			if (row is None):
+				return None
+			self.connection.execute("UPDATE results SET used = ? WHERE key = ?", (time.time_ns(), key))
+		return json.loads(row[0])
+
+	def put(self, params, value):
+		value = json.dumps(value)
+		with self.connection:
+			self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (cache_key(params), value, len(value), time.time_ns()))
+			self.evict()
+
+	def evict(self):
+		size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+		if (size <= self.max_bytes):
+			return
+		for key, value_size in self.connection.execute("SELECT key, size FROM results ORDER BY used").fetchall():
+			if (size <= self.max_bytes):
+				break
+			self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+			size -= value_size
+
+	def close(self):
+		self.connection.close()
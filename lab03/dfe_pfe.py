@@ -1,7 +1,8 @@
-from model import Model
+from model import Model, pool_map, point_values, mean_runs, point_seed, analytic_wait, make_seed_sequence
 import random
 import numpy
 import math
+import os
 from prettytable import PrettyTable
 from itertools import combinations
 from scipy import stats
@@ -16,94 +17,224 @@ def get_value(x_min, x_max, prop):
 def get_prop(x_min, x_max, x):
 	return 2 * (x - x_min) / (x_max - x_min) - 1
 
+# walsh-hadamard transform of y (length 2^k) in place: y[mask] becomes the sum of y[row] with the sign
+# (-1)^(number of bits set in both row and mask). k passes of sums and differences of pairs h apart,
+# so all the effects of a full plan take O(N log N) and none of its columns is built
+def fwht(y):
+	h = 1
+	while (h < len(y)):
+		pairs = y.reshape(-1, 2, h)
+		first = pairs[:, 0].copy()
+		pairs[:, 0] += pairs[:, 1]
+		pairs[:, 1] = first - pairs[:, 1]
+		h *= 2
+	return y
+
+# coefficients of all the interactions of a 2^k plan with responses y, effects[mask] is the mean of y
+# times the column of the product of the factors of the bits of mask (-1 in the rows with the bit set)
+def plan_effects(y, k):
+	return fwht(numpy.array(y, dtype = float)) / 2 ** k
+
+# bitmask of the factors of word (numbers from 1), factor f of k is bit k - 1 - f like in the interactions of PFE
+def word_mask(word, k):
+	mask = 0
+	for factor in word:
+		mask |= 1 << (k - factor)
+	return mask
+
+# words of the defining relation of a 2^(k-p) plan (I is mask 0): factor k - p + 1 + i is the product of the
+# base factors of generators[i], so the two together multiply to I, and so do all the products of such words
+def defining_relation(k, p, generators):
+	words = [0]
+	for i, generator in enumerate(generators):
+		word = word_mask(generator, k) | word_mask([k - p + 1 + i], k)
+		words += [other ^ word for other in words]
+	return words
+
+# factors of the mask of word_mask, "125" for x1x2x5
+def word_label(mask, k):
+	return "".join([str(factor) for factor in range(1, k + 1) if (mask & (1 << (k - factor)))])
+
+# ValueError if the generators don't give a 2^(k-p) plan where all main effects can be told apart:
+# two generators with the same base factors make their generated factors equal and any word of the defining
+# relation shorter than 3 aliases two main effects. Every generator word has its own generated factor, so
+# the words are independent whatever the base factors: x4 = x1x2, x5 = x1x3, x6 = x2x3 is allowed,
+# it is the minimum aberration 2^(6-3) plan
+def check_generators(k, p, generators):
+	masks = [word_mask(generator, k) for generator in generators]
+	if (len(set(masks)) < len(masks)):
+		raise ValueError("генераторы " + str(generators) + " повторяют одно и то же произведение факторов")
+	short = [word_label(word, k) for word in defining_relation(k, p, generators)[1:] if bin(word).count("1") < 3]
+	if (len(short) > 0):
+		raise ValueError("в определяющем контрасте генераторов " + str(generators) + " есть слова короче 3: " + ", ".join(short))
+
+# numbers of the words of every length in the defining relation, of two plans the one with the
+# lexicographically smaller pattern has less aberration
+def word_length_pattern(k, p, generators):
+	pattern = [0] * (k + 1)
+	for word in defining_relation(k, p, generators)[1:]:
+		pattern[bin(word).count("1")] += 1
+	return pattern
+
+# generators of a minimum aberration 2^(k-p) plan, every choice of p products of at least two base factors
+# is compared. When there are more than max_choices choices the generators are picked one at a time,
+# each the best with the ones picked before, which is fast but not always minimum aberration
+def minimum_aberration_generators(k, p, max_choices = 100000):
+	candidates = [list(word) for size in range(2, k - p + 1) for word in combinations(range(1, k - p + 1), size)]
+	assert(len(candidates) >= p)
+	if (math.comb(len(candidates), p) <= max_choices):
+		return list(min(combinations(candidates, p), key = lambda generators: word_length_pattern(k, p, generators)))
+	generators = []
+	for i in range(p):
+		generators.append(min([word for word in candidates if word not in generators], key = lambda word: word_length_pattern(k, p, generators + [word])))
+	return generators
+
 class PFE:
 	# [[m1_min, m1_max], [m2_min, m2_max], [sigma2_min, sigma2_max]]
-	def __init__ (self, min_max_factors, times):
+	# every experiment gets its own random streams spawned from seed
+	# experiments are run on workers processes
+	# with half_width every experiment adds times runs at a time until the half width of the confidence
+	# interval of its y is below half_width or it has max_times runs
+	# with run_length every experiment is one run that long and its batch means stand for the runs
+	# with truncate_warmup every run drops its start transient before its waiting times are averaged
+	# with common_random_numbers run r of every experiment uses the same random streams
+	# with control_variates the runs are adjusted by the known means of interarrival and operate times
+	# cache is the path of the result cache (cache.Cache), experiments simulated before are taken from it
+	# store is a dict shared with other plans of the session, values of an experiment at a point one of them
+	# already simulated with the same settings are taken from it, without a store only the means and
+	# dispersions of y are kept.
+	# The rows of the plan are not stored, they are made, simulated and printed block_size experiments at a time
+	def __init__ (self, min_max_factors, times, seed = None, workers = 1, half_width = None, max_times = 100, run_length = None, truncate_warmup = False, common_random_numbers = False, control_variates = False, cache = None, store = None, block_size = 4096):
 		self.factors = min_max_factors
+		self.seed_sequence = make_seed_sequence(seed)
+		self.workers = workers
+		self.half_width = half_width
+		self.max_times = max_times
+		self.run_length = run_length
+		self.truncate_warmup = truncate_warmup
+		self.common_random_numbers = common_random_numbers
+		self.control_variates = control_variates
+		self.cache = cache
+		self.store = store
+		self.block_size = block_size
 		self.number_of_factors = len(min_max_factors)
 		self.number_of_experiments = 2 ** self.number_of_factors
-		self.create_plan_table()
-		self.create_real_table(min_max_factors)
+		self.print_plan_table()
 		self.times = times
+		self.replications = times
 		self.experiment_data_filled = False
 		self.calculated_data_filled = False
 
-	def create_real_table(self, min_max_factors):
-		self.real_table = []
-		for experiment in range (self.number_of_experiments):
-			tablerow = []
-			for factor in range (self.number_of_factors):
-				if (self.plan_table[experiment][factor] == 1):
-					tablerow.append(min_max_factors[factor][1])
-				else:
-					tablerow.append(min_max_factors[factor][0])
-			self.real_table.append(tablerow)
+	# coded values of the factors in experiments start..stop, one row each: factor f is -1 in the
+	# experiments with bit k - 1 - f set
+	def plan_rows(self, start, stop):
+		experiments = numpy.arange(start, stop)[:, None]
+		return 1 - 2 * ((experiments >> (self.number_of_factors - 1 - numpy.arange(self.number_of_factors))) & 1)
 
-	def create_plan_table(self):
-		self.plan_table = []
-		for experiment in range (self.number_of_experiments):
-			tablerow = []
-			for factor in range (self.number_of_factors):
-				if (experiment & (1 << factor)):
-					tablerow.insert(0, -1)
-				else:
-					tablerow.insert(0, 1)
-			self.plan_table.append(tablerow)
-		self.print_plan_table()
+	# (start, stop) of the blocks of experiments the plan is made, simulated and printed in
+	def blocks(self):
+		return [(start, min(start + self.block_size, self.number_of_experiments)) for start in range(0, self.number_of_experiments, self.block_size)]
+
+	# natural values of the factors in experiments start..stop, the max of a factor where it is 1 in plan_rows
+	def real_rows(self, start, stop):
+		return numpy.where(self.plan_rows(start, stop) == 1, [factor[1] for factor in self.factors], [factor[0] for factor in self.factors])
 
 	def print_plan_table(self):
-		pt = PrettyTable()
 		field_names = ['#']
 		for factor in range (self.number_of_factors + 1):
 			field_names.append('x' + str(factor))
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.plan_table:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			insertrow.insert(1, str(1))
-			pt.add_row(insertrow)
-			i += 1
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			i = start + 1
+			for row in self.plan_rows(start, stop).tolist():
+				row.insert(0, i)
+				row.insert(1, str(1))
+				pt.add_row(row)
+				i += 1
+			print(pt)
+
+	# generators of the model in an experiment with natural values of the factors row (of real_rows)
+	def experiment_conf(self, row):
+		sigma1 =  1 / row[0] * math.sqrt(2 / math.pi)
+		a1 = 1/row[1] - row[2] * math.sqrt(3)
+		b1 = 1/row[1] + row[2] * math.sqrt(3)
+		sigma2 =  1 / row[3] * math.sqrt(2 / math.pi)
+		a2 = 1/row[4] - row[5] * math.sqrt(3)
+		b2 = 1/row[4] + row[5] * math.sqrt(3)
+		return [[sigma1, a1, b1], [sigma2, a2, b2]]
+
+	# analytic approximation of y in every experiment (analytic_wait), -1 where the operator is overloaded,
+	# the factor space can be screened with it before anything is simulated
+	def analytic_screen(self):
+		waits = []
+		for start, stop in self.blocks():
+			waits += [float(analytic_wait(self.experiment_conf(row))) for row in self.real_rows(start, stop).tolist()]
+		pt = PrettyTable()
+		pt.field_names = ['#', 'аналитическое y']
+		for experiment in range(self.number_of_experiments):
+			pt.add_row([experiment + 1, 'перегрузка' if waits[experiment] == -1 else waits[experiment]])
 		print(pt)
+		return waits
+
+	# key of an experiment with natural values of the factors row in the store: the point and the settings its values depend on
+	def store_key(self, row):
+		return (tuple(row), self.times, self.half_width, self.max_times, self.run_length, self.truncate_warmup, self.common_random_numbers, self.control_variates)
 
+	# every block of experiments is simulated on the workers before the next one is made, only the mean y,
+	# its dispersion and the number of runs of every experiment are kept
 	def fill_experiment_data(self):
 		self.experiment_data_filled = True
 		sumdisppersion = 0
 		maxdispersion = 0
-		for experiment in range (self.number_of_experiments):
-			sigma1 =  1 / self.real_table[experiment][0] * math.sqrt(2 / math.pi)
-			a1 = 1/self.real_table[experiment][1] - self.real_table[experiment][2] * math.sqrt(3)
-			b1 = 1/self.real_table[experiment][1] + self.real_table[experiment][2] * math.sqrt(3)
-			sigma2 =  1 / self.real_table[experiment][3] * math.sqrt(2 / math.pi)
-			a2 = 1/self.real_table[experiment][4] - self.real_table[experiment][5] * math.sqrt(3)
-			b2 = 1/self.real_table[experiment][4] + self.real_table[experiment][5] * math.sqrt(3)
-
-			model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
-			y_ex_values = model.array_calculate(self.times)
-			y_ex_avg = sum(y_ex_values) / len (y_ex_values)
-			self.real_table[experiment].append(y_ex_avg)
-			y_dispersion = sum([(y_ex_avg - y_ex_value)**2 / self.times for y_ex_value in y_ex_values])
-			self.real_table[experiment].append(y_dispersion)
-			if (y_dispersion > maxdispersion):
-				maxdispersion = y_dispersion
-			sumdisppersion += y_dispersion
+		self.y = numpy.zeros(self.number_of_experiments)
+		self.dispersion = numpy.zeros(self.number_of_experiments)
+		self.run_counts = numpy.zeros(self.number_of_experiments, dtype = int)
+		for start, stop in self.blocks():
+			rows = self.real_rows(start, stop).tolist()
+			keys = [self.store_key(row) for row in rows]
+			new_keys = {}
+			points = []
+			for experiment in range (start, stop):
+				key = keys[experiment - start]
+				if ((self.store is None or key not in self.store) and key not in new_keys):
+					new_keys[key] = len(points)
+					points.append((0, 100, self.experiment_conf(rows[experiment - start]), 1, 'lockstep', point_seed(self.seed_sequence, experiment, self.common_random_numbers), self.times, self.half_width, self.max_times, self.run_length, self.truncate_warmup, self.control_variates, self.cache))
+			new_values = pool_map(point_values, points, self.workers)
+			if (self.store is not None):
+				for key in new_keys:
+					self.store[key] = new_values[new_keys[key]]
+
+			for experiment in range(start, stop):
+				key = keys[experiment - start]
+				y_ex_values = new_values[new_keys[key]] if key in new_keys else self.store[key]
+				self.run_counts[experiment] = len(y_ex_values)
+				y_ex_avg = sum(y_ex_values) / len (y_ex_values)
+				self.y[experiment] = y_ex_avg
+				y_dispersion = sum([(y_ex_avg - y_ex_value)**2 / len(y_ex_values) for y_ex_value in y_ex_values])
+				self.dispersion[experiment] = y_dispersion
+				if (y_dispersion > maxdispersion):
+					maxdispersion = y_dispersion
+				sumdisppersion += y_dispersion
 
 		Gp = maxdispersion / sumdisppersion
 		print("Критерий Кохрена: ", Gp)
 		self.S = sumdisppersion / self.number_of_experiments
 		print("дисперсии воспроизводимости ", self.S)
-		self.Sak = (self.S / self.number_of_experiments / self.times) ** 0.5
+		self.replications = mean_runs(self.run_counts.tolist())
+		self.Sak = (self.S / self.number_of_experiments / self.replications) ** 0.5
 		print("среднее квадратическое отклонение коэффициента", self.Sak)
-		self.student_table = stats.t(df=(self.number_of_experiments * (self.times - 1))).ppf(0.95) #1.998
+		self.student_table = stats.t(df=(int(self.run_counts.sum()) - self.number_of_experiments)).ppf(0.95) #1.998
 		self.meaningful_koefs = 0
 
 	def calculate_koefs(self):
 		self.koefs = []
-		y_ex_avg_sum = 0
-		for experiment in range(self.number_of_experiments):
-			y_ex_avg_sum += self.real_table[experiment][self.number_of_factors]
-		self.koefs.append(y_ex_avg_sum / self.number_of_experiments) #a0
+		# effects[mask] is the coefficient of the product of the factors of the bits of mask, factor f is
+		# -1 in the rows of plan_rows with bit k - 1 - f set. mask_koefs keeps the significant ones by mask
+		effects = plan_effects(self.y, self.number_of_factors)
+		self.mask_koefs = numpy.zeros(self.number_of_experiments)
+		self.koefs.append(effects[0].item()) #a0
 		koef_meaning = abs(self.koefs[0])/self.Sak
 		print("Критерий Стьюдента: ", self.student_table)
 		if (koef_meaning >= self.student_table):
@@ -115,20 +246,15 @@ class PFE:
 		print ("a 0\t", round(self.koefs[0], 7), "\t", round(koef_meaning, 7), end = ending)
 		if (koef_meaning < self.student_table):
 			self.koefs[0] = 0
+		self.mask_koefs[0] = self.koefs[0]
 
 		factor_indexes = []
 		for i in range (self.number_of_factors):
 			factor_indexes.append(i)
 		for i in range (1, self.number_of_factors + 1):
 			for j in combinations(factor_indexes, i):
-				koef_value = 0
-				for experiment in range(self.number_of_experiments):
-					mult = 1
-					for k in range(i):
-						mult *= self.plan_table[experiment][j[k]]
-					koef_value += mult * self.real_table[experiment][self.number_of_factors]
-
-				koef_value /= self.number_of_experiments
+				mask = sum([1 << (self.number_of_factors - 1 - k) for k in j])
+				koef_value = effects[mask].item()
 				koef_meaning = abs(koef_value)/self.Sak
 				if (koef_meaning >= self.student_table):
 					ending = "\t✓\n"
@@ -139,6 +265,7 @@ class PFE:
 				if (koef_meaning < self.student_table):
 					koef_value = 0
 				self.koefs.append(koef_value)
+				self.mask_koefs[mask] = koef_value
 
 	def calculate_partly_nonlinear(self, factors):
 		result = self.koefs[0]
@@ -162,21 +289,23 @@ class PFE:
 	def fill_calculated_data(self):
 		self.calculate_koefs()
 		self.calculated_data_filled = True
-		for experiment in range (self.number_of_experiments):
-			y_cal_value_non = self.calculate_partly_nonlinear(self.plan_table[experiment])
-			y_cal_value = self.calculate_linear(self.plan_table[experiment])
-			self.real_table[experiment].append(y_cal_value)
-			self.real_table[experiment].append(y_cal_value_non)
-			y_ex_value = self.real_table[experiment][self.number_of_factors]
-			self.real_table[experiment].append(y_ex_value - y_cal_value)
-			self.real_table[experiment].append(y_ex_value - y_cal_value_non)
+		# the partly nonlinear model in all the rows of the plan is the transform of its coefficients by mask
+		self.y_nonlinear = fwht(self.mask_koefs.copy())
+		# calculate_linear of all the rows of a block at once, adding the terms in the same order
+		self.y_linear = numpy.zeros(self.number_of_experiments)
+		for start, stop in self.blocks():
+			plan = self.plan_rows(start, stop)
+			y_cal_values = numpy.full(stop - start, float(self.koefs[0]))
+			for i in range (self.number_of_factors):
+				y_cal_values += self.koefs[i + 1] * plan[:, i]
+			self.y_linear[start:stop] = y_cal_values
 
 	def check_adequacy(self):
 		print("дисперсии воспроизводимости ", self.S)
 		diffsqsum = 0
-		for row in self.real_table:
-			diffsqsum += row[self.number_of_factors + 5]**2
-		self.Ss = self.times / (self.number_of_experiments - self.meaningful_koefs) * diffsqsum
+		for difference in (self.y - self.y_nonlinear).tolist():
+			diffsqsum += difference**2
+		self.Ss = self.replications / (self.number_of_experiments - self.meaningful_koefs) * diffsqsum
 		print("дисперсия адекватности: ", self.Ss)
 		self.F = self.Ss / self.S
 		print("Критерий Фишера (ад / вос): ", self.F)
@@ -190,11 +319,10 @@ class PFE:
 
 	def printtable(self):
 		if (self.experiment_data_filled):
-			pt = PrettyTable()
 			field_names = ['#']
 			for factor in range (self.number_of_factors):
 				field_names.append('x' + str(factor + 1))
-			field_names.append('y среднее из ' + str(self.times) + ' опытов')
+			field_names.append('y среднее из ' + str(self.replications) + ' опытов')
 			field_names.append('дисперсия y')
 
 		if (self.calculated_data_filled):
@@ -203,158 +331,223 @@ class PFE:
 			field_names.append('разница (линейное)')
 			field_names.append('разница (частично нелинейное)')
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.real_table:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			pt.add_row(insertrow)
-			i += 1
-		print(pt)
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			columns = [self.y[start:stop], self.dispersion[start:stop]]
+			if (self.calculated_data_filled):
+				y_linear = self.y_linear[start:stop]
+				y_nonlinear = self.y_nonlinear[start:stop]
+				columns += [y_linear, y_nonlinear, self.y[start:stop] - y_linear, self.y[start:stop] - y_nonlinear]
+			i = start + 1
+			for row, values in zip(self.real_rows(start, stop).tolist(), numpy.column_stack(columns).tolist()):
+				pt.add_row([i] + row + values)
+				i += 1
+			print(pt)
 
 class DFE:
-	def __init__ (self, min_max_factors, times, p):
+	# the last p factors are generated: factor k - p + 1 + i is the product of the base factors (numbers from 1)
+	# of generators[i], by default of the pairs 1 2, 3 4, ... With generators = 'auto' they are chosen
+	# by minimum_aberration_generators. The other arguments are the ones of PFE
+	def __init__ (self, min_max_factors, times, p, seed = None, workers = 1, half_width = None, max_times = 100, run_length = None, truncate_warmup = False, common_random_numbers = False, control_variates = False, cache = None, store = None, generators = None, block_size = 4096):
 		self.factors = min_max_factors
+		self.seed_sequence = make_seed_sequence(seed)
+		self.workers = workers
+		self.half_width = half_width
+		self.max_times = max_times
+		self.run_length = run_length
+		self.truncate_warmup = truncate_warmup
+		self.common_random_numbers = common_random_numbers
+		self.control_variates = control_variates
+		self.cache = cache
+		self.store = store
+		self.block_size = block_size
 		self.number_of_factors = len(min_max_factors)
 		self.p = p
 		self.number_of_experiments = 2 ** (self.number_of_factors - self.p)
-		self.create_plan_table()
-		self.create_real_table(min_max_factors)
+		if (generators is None):
+			generators = [[2 * index + 1, 2 * index + 2] for index in range(self.p)]
+		elif (generators == 'auto'):
+			generators = minimum_aberration_generators(self.number_of_factors, self.p)
+		assert(len(generators) == self.p)
+		for generator in generators:
+			assert(len(set(generator)) >= 2 and all(1 <= factor <= self.number_of_factors - self.p for factor in generator))
+		check_generators(self.number_of_factors, self.p, generators)
+		self.generators = generators
+		self.create_alias_sets()
+		self.print_plan_table()
 		self.times = times
+		self.replications = times
 		self.experiment_data_filled = False
 		self.calculated_data_filled = False
 
-	def create_real_table(self, min_max_factors):
-		self.real_table = []
-		for experiment in range (self.number_of_experiments):
-			tablerow = []
-			for factor in range (self.number_of_factors):
-				if (self.plan_table[experiment][factor] == 1):
-					tablerow.append(min_max_factors[factor][1])
-				else:
-					tablerow.append(min_max_factors[factor][0])
-			self.real_table.append(tablerow)
-
-	def create_plan_table(self):
-		self.plan_table = []
-		for experiment in range (self.number_of_experiments):
-			tablerow = []
-			for factor in range (self.number_of_factors - self.p - 1, -1, -1):
-				if (experiment & (1 << factor)):
-					tablerow.append(-1)
-				else:
-					tablerow.append(1)
-			for index in range (self.p):
-				tablerow.append(tablerow[2 * index] * tablerow[2 * index + 1])
-			self.plan_table.append(tablerow)
-		self.print_plan_table()
+	# coded values of the factors in experiments start..stop: base factor f is -1 in the experiments
+	# with bit k - p - 1 - f set, the generated factors are the products of their generators
+	def plan_rows(self, start, stop):
+		experiments = numpy.arange(start, stop)[:, None]
+		base = 1 - 2 * ((experiments >> (self.number_of_factors - self.p - 1 - numpy.arange(self.number_of_factors - self.p))) & 1)
+		return numpy.hstack([base] + [numpy.prod(base[:, [factor - 1 for factor in generator]], axis = 1, keepdims = True) for generator in self.generators])
+
+	# (start, stop) of the blocks of experiments the plan is made, simulated and printed in
+	def blocks(self):
+		return [(start, min(start + self.block_size, self.number_of_experiments)) for start in range(0, self.number_of_experiments, self.block_size)]
+
+	# natural values of the factors in experiments start..stop, the max of a factor where it is 1 in plan_rows
+	def real_rows(self, start, stop):
+		return numpy.where(self.plan_rows(start, stop) == 1, [factor[1] for factor in self.factors], [factor[0] for factor in self.factors])
+
+	# factor numbers of mask of word_mask
+	def label(self, mask):
+		return word_label(mask, self.number_of_factors)
+
+	# column of the plan that interaction mask equals: every generated factor is replaced by its base factors.
+	# Base factor f is bit k - 1 - f of mask and bit k - p - 1 - f of the row numbers of plan_rows,
+	# so the column is the sign (-1)^(number of bits set in both row and mask >> p), the mask of fwht
+	def column(self, mask):
+		for index in range(self.p):
+			if (mask & (1 << (self.p - 1 - index))):
+				mask ^= self.generator_words[index]
+		return mask >> self.p
+
+	# the defining relation and the alias sets: interactions with the same column, mask ^ word for the words.
+	# Every set without I and main effects is estimated by its first interaction in the order of combinations
+	# (fewest factors first), koef_masks are the masks of a0, the main effects and these interactions
+	def create_alias_sets(self):
+		self.words = defining_relation(self.number_of_factors, self.p, self.generators)
+		self.generator_words = [self.words[1 << index] for index in range(self.p)]
+		interactions = []
+		for column in range(self.number_of_experiments):
+			aliases = [(column << self.p) ^ word for word in self.words]
+			first = min(aliases, key = lambda mask: (bin(mask).count("1"), -mask))
+			if (bin(first).count("1") >= 2):
+				interactions.append(first)
+		interactions.sort(key = lambda mask: (bin(mask).count("1"), -mask))
+		self.koef_masks = [0] + [1 << (self.number_of_factors - 1 - factor) for factor in range(self.number_of_factors)] + interactions
 
 	def print_plan_table(self):
-		pt = PrettyTable()
+		print("определяющий контраст: I =", " = ".join([self.label(word) for word in self.words[1:]]))
 		field_names = ['#']
 		for factor in range (self.number_of_factors + 1):
 			field_names.append('x' + str(factor))
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.plan_table:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			insertrow.insert(1, str(1))
-			pt.add_row(insertrow)
-			i += 1
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			i = start + 1
+			for row in self.plan_rows(start, stop).tolist():
+				row.insert(0, i)
+				row.insert(1, str(1))
+				pt.add_row(row)
+				i += 1
+			print(pt)
+
+	# generators of the model in an experiment with natural values of the factors row (of real_rows)
+	def experiment_conf(self, row):
+		sigma1 =  1 / row[0] * math.sqrt(2 / math.pi)
+		a1 = 1/row[1] - row[2] * math.sqrt(3)
+		b1 = 1/row[1] + row[2] * math.sqrt(3)
+		sigma2 =  1 / row[3] * math.sqrt(2 / math.pi)
+		a2 = 1/row[4] - row[5] * math.sqrt(3)
+		b2 = 1/row[4] + row[5] * math.sqrt(3)
+		return [[sigma1, a1, b1], [sigma2, a2, b2]]
+
+	# analytic approximation of y in every experiment (analytic_wait), -1 where the operator is overloaded,
+	# the factor space can be screened with it before anything is simulated
+	def analytic_screen(self):
+		waits = []
+		for start, stop in self.blocks():
+			waits += [float(analytic_wait(self.experiment_conf(row))) for row in self.real_rows(start, stop).tolist()]
+		pt = PrettyTable()
+		pt.field_names = ['#', 'аналитическое y']
+		for experiment in range(self.number_of_experiments):
+			pt.add_row([experiment + 1, 'перегрузка' if waits[experiment] == -1 else waits[experiment]])
 		print(pt)
+		return waits
+
+	# key of an experiment with natural values of the factors row in the store: the point and the settings its values depend on
+	def store_key(self, row):
+		return (tuple(row), self.times, self.half_width, self.max_times, self.run_length, self.truncate_warmup, self.common_random_numbers, self.control_variates)
 
+	# every block of experiments is simulated on the workers before the next one is made, only the mean y,
+	# its dispersion and the number of runs of every experiment are kept
 	def fill_experiment_data(self):
 		self.experiment_data_filled = True
 		sumdisppersion = 0
 		maxdispersion = 0
-		for experiment in range (self.number_of_experiments):
-			sigma1 =  1 / self.real_table[experiment][0] * math.sqrt(2 / math.pi)
-			a1 = 1/self.real_table[experiment][1] - self.real_table[experiment][2] * math.sqrt(3)
-			b1 = 1/self.real_table[experiment][1] + self.real_table[experiment][2] * math.sqrt(3)
-			sigma2 =  1 / self.real_table[experiment][3] * math.sqrt(2 / math.pi)
-			a2 = 1/self.real_table[experiment][4] - self.real_table[experiment][5] * math.sqrt(3)
-			b2 = 1/self.real_table[experiment][4] + self.real_table[experiment][5] * math.sqrt(3)
-
-			model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
-			y_ex_values = model.array_calculate(self.times)
-			y_ex_avg = sum(y_ex_values) / len (y_ex_values)
-			self.real_table[experiment].append(y_ex_avg)
-			y_dispersion = sum([(y_ex_avg - y_ex_value)**2 / self.times for y_ex_value in y_ex_values])
-			self.real_table[experiment].append(y_dispersion)
-			if (y_dispersion > maxdispersion):
-				maxdispersion = y_dispersion
-			sumdisppersion += y_dispersion
+		self.y = numpy.zeros(self.number_of_experiments)
+		self.dispersion = numpy.zeros(self.number_of_experiments)
+		self.run_counts = numpy.zeros(self.number_of_experiments, dtype = int)
+		for start, stop in self.blocks():
+			rows = self.real_rows(start, stop).tolist()
+			keys = [self.store_key(row) for row in rows]
+			new_keys = {}
+			points = []
+			for experiment in range (start, stop):
+				key = keys[experiment - start]
+				if ((self.store is None or key not in self.store) and key not in new_keys):
+					new_keys[key] = len(points)
+					points.append((0, 100, self.experiment_conf(rows[experiment - start]), 1, 'lockstep', point_seed(self.seed_sequence, experiment, self.common_random_numbers), self.times, self.half_width, self.max_times, self.run_length, self.truncate_warmup, self.control_variates, self.cache))
+			new_values = pool_map(point_values, points, self.workers)
+			if (self.store is not None):
+				for key in new_keys:
+					self.store[key] = new_values[new_keys[key]]
+
+			for experiment in range(start, stop):
+				key = keys[experiment - start]
+				y_ex_values = new_values[new_keys[key]] if key in new_keys else self.store[key]
+				self.run_counts[experiment] = len(y_ex_values)
+				y_ex_avg = sum(y_ex_values) / len (y_ex_values)
+				self.y[experiment] = y_ex_avg
+				y_dispersion = sum([(y_ex_avg - y_ex_value)**2 / len(y_ex_values) for y_ex_value in y_ex_values])
+				self.dispersion[experiment] = y_dispersion
+				if (y_dispersion > maxdispersion):
+					maxdispersion = y_dispersion
+				sumdisppersion += y_dispersion
 
 		Gp = maxdispersion / sumdisppersion
 		print("Критерий Кохрена: ", Gp)
 		self.S = sumdisppersion / self.number_of_experiments
 		print("дисперсии воспроизводимости ", self.S)
-		self.Sak = (self.S / self.number_of_experiments / self.times) ** 0.5
+		self.replications = mean_runs(self.run_counts.tolist())
+		self.Sak = (self.S / self.number_of_experiments / self.replications) ** 0.5
 		print("среднее квадратическое отклонение коэффициента", self.Sak)
-		self.student_table = stats.t(df=(self.number_of_experiments * (self.times - 1))).ppf(0.95) #1.998
+		self.student_table = stats.t(df=(int(self.run_counts.sum()) - self.number_of_experiments)).ppf(0.95) #1.998
 		self.meaningful_koefs = 0
 
 	def calculate_koefs(self):
-		self.koefs = []
+		effects = plan_effects(self.y, self.number_of_factors - self.p)
+		self.koefs = [effects[self.column(mask)].item() for mask in self.koef_masks]
+		# significant coefficients by column, the partly nonlinear model in the rows of the plan is their transform
+		self.column_koefs = numpy.zeros(self.number_of_experiments)
+		self.allkoefs = None
 
-		sum_avg = 0
-		for exp in range(self.number_of_experiments):
-			sum_avg += self.real_table[exp][self.number_of_factors]
-		self.koefs.append(sum_avg / self.number_of_experiments)
-
-		for factor in range(self.number_of_factors):
-			sum_avg = 0
-			for exp in range(self.number_of_experiments):
-				sum_avg += self.real_table[exp][self.number_of_factors] * self.real_table[exp][factor]
-			self.koefs.append(sum_avg / self.number_of_experiments)
-
-
-		koef_needed = [[1,3], [1, 4], [1, 6], [2, 3], [2, 4], [2, 6], [3, 5], [4, 5], [5, 6]]
-		for koef in koef_needed:
-			sum_avg = 0
-			for exp in range(self.number_of_experiments):
-				mult = self.real_table[exp][self.number_of_factors]
-				for index in koef:
-					mult *= self.real_table[exp][index - 1]
-				sum_avg += mult
-			self.koefs.append(sum_avg / self.number_of_experiments)
-
-		index = 0
 		print("Критерий Стьюдента: ", self.student_table, "\n")
 		for koef_index in range(len(self.koefs)):
 			koef_value = self.koefs[koef_index]
 			koef_meaning = abs(koef_value)/self.Sak
-			indexstr = ""
-			if (index <= self.number_of_factors):
-				indexstr = str(index)
-			else:
-				koef = koef_needed[index - self.number_of_factors - 1]
-				for ind in koef:
-					indexstr += str(ind)
+			indexstr = self.label(self.koef_masks[koef_index]) if koef_index > 0 else "0"
 			if (koef_meaning >= self.student_table):
 				self.meaningful_koefs += 1
 				print("a", indexstr,"*", koef_value, "✓")
+				self.column_koefs[self.column(self.koef_masks[koef_index])] += koef_value
 			else:
 				print("a", indexstr,"*", koef_value)
 				self.koefs[koef_index] = 0
-			index += 1
+
+	# coefficients of all the interactions in the order of combinations: a main effect has its own,
+	# every interaction of a set of koef_masks gets 1 / 2^p of the coefficient of the set, the rest are 0
+	def create_allkoefs(self):
+		set_koefs = {}
+		for koef_index in range(self.number_of_factors + 1, len(self.koefs)):
+			set_koefs[self.column(self.koef_masks[koef_index])] = self.koefs[koef_index] / 2 ** self.p
+		self.allkoefs = self.koefs[:self.number_of_factors + 1]
+		for i in range (2, self.number_of_factors + 1):
+			for j in combinations(range(self.number_of_factors), i):
+				self.allkoefs.append(set_koefs.get(self.column(word_mask([factor + 1 for factor in j], self.number_of_factors)), 0))
 
 	def calculate_partly_nonlinear(self, factors):
-		self.allkoefs = self.koefs[:self.number_of_factors+1]
-		a13 = self.koefs[self.number_of_factors + 1] / 4
-		a14 = self.koefs[self.number_of_factors + 2] / 4
-		a16 = self.koefs[self.number_of_factors + 3] / 4
-		a23 = self.koefs[self.number_of_factors + 4] / 4
-		a24 = self.koefs[self.number_of_factors + 5] / 4
-		a26 = self.koefs[self.number_of_factors + 6] / 4
-		a35 = self.koefs[self.number_of_factors + 7] / 4
-		a45 = self.koefs[self.number_of_factors + 8] / 4
-		a56 = self.koefs[self.number_of_factors + 9] / 4
-
-		rest_koefs = [0, a13, a14, 0, a16, a23, a24, 0, a26, 0, a35, 0, a45, 0, a56, a35, a45, 0, a56, a16, a23, a14, a24, a13, a26, a26, a13, a24, a14, a23, a16, a56, 0, a45, a35, a56, 0, a45, 0, a35, 0, a26, 0, a24, a23, a16, 0, a14, a13, 0, 0, 0, 0, 0, 0, 0, 0]
-		self.allkoefs += rest_koefs
+		if (self.allkoefs is None):
+			self.create_allkoefs()
 		result = self.allkoefs[0]
 
 		koef_index = 1
@@ -376,21 +569,23 @@ class DFE:
 	def fill_calculated_data(self):
 		self.calculate_koefs()
 		self.calculated_data_filled = True
-		for experiment in range (self.number_of_experiments):
-			y_cal_value_non = self.calculate_partly_nonlinear(self.plan_table[experiment])
-			y_cal_value = self.calculate_linear(self.plan_table[experiment])
-			self.real_table[experiment].append(y_cal_value)
-			self.real_table[experiment].append(y_cal_value_non)
-			y_ex_value = self.real_table[experiment][self.number_of_factors]
-			self.real_table[experiment].append(y_ex_value - y_cal_value)
-			self.real_table[experiment].append(y_ex_value - y_cal_value_non)
+		# the partly nonlinear model in all the rows of the plan is the transform of its coefficients by column
+		self.y_nonlinear = fwht(self.column_koefs.copy())
+		# calculate_linear of all the rows of a block at once, adding the terms in the same order
+		self.y_linear = numpy.zeros(self.number_of_experiments)
+		for start, stop in self.blocks():
+			plan = self.plan_rows(start, stop)
+			y_cal_values = numpy.full(stop - start, float(self.koefs[0]))
+			for i in range (self.number_of_factors):
+				y_cal_values += self.koefs[i + 1] * plan[:, i]
+			self.y_linear[start:stop] = y_cal_values
 
 	def check_adequacy(self):
 		print("дисперсии воспроизводимости ", self.S)
 		diffsqsum = 0
-		for row in self.real_table:
-			diffsqsum += row[self.number_of_factors + 5]**2
-		self.Ss = self.times / (self.number_of_experiments - self.meaningful_koefs) * diffsqsum
+		for difference in (self.y - self.y_nonlinear).tolist():
+			diffsqsum += difference**2
+		self.Ss = self.replications / (self.number_of_experiments - self.meaningful_koefs) * diffsqsum
 		print("дисперсия адекватности: ", self.Ss)
 		self.F = self.Ss / self.S
 		print("Критерий Фишера (ад / вос): ", self.F)
@@ -404,11 +599,10 @@ class DFE:
 
 	def printtable(self):
 		if (self.experiment_data_filled):
-			pt = PrettyTable()
 			field_names = ['#']
 			for factor in range (self.number_of_factors):
 				field_names.append('x' + str(factor + 1))
-			field_names.append('y среднее из ' + str(self.times) + ' опытов')
+			field_names.append('y среднее из ' + str(self.replications) + ' опытов')
 			field_names.append('дисперсия y')
 
 		if (self.calculated_data_filled):
@@ -417,14 +611,19 @@ class DFE:
 			field_names.append('разница (линейное)')
 			field_names.append('разница (частично нелинейное)')
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.real_table:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			pt.add_row(insertrow)
-			i += 1
-		print(pt)
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			columns = [self.y[start:stop], self.dispersion[start:stop]]
+			if (self.calculated_data_filled):
+				y_linear = self.y_linear[start:stop]
+				y_nonlinear = self.y_nonlinear[start:stop]
+				columns += [y_linear, y_nonlinear, self.y[start:stop] - y_linear, self.y[start:stop] - y_nonlinear]
+			i = start + 1
+			for row, values in zip(self.real_rows(start, stop).tolist(), numpy.column_stack(columns).tolist()):
+				pt.add_row([i] + row + values)
+				i += 1
+			print(pt)
 
 def getdotbyprop(pfe, dfe):
 	x1_min = pfe.factors[0][0]
@@ -468,7 +667,7 @@ def getdotbyprop(pfe, dfe):
 	a2 = 1/x5 - x6 * math.sqrt(3)
 	b2 = 1/x5 + x6 * math.sqrt(3)
 
-	model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
+	model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1, 'lockstep')
 	y_avg = model.calculate(5)
 	y_linear = pfe.calculate_linear([x1, x2, x3, x4, x5, x6])
 	y_nonlinear = pfe.calculate_partly_nonlinear([x1, x2, x3, x4, x5, x6])
@@ -512,7 +711,9 @@ if __name__ == "__main__":
 	min_max_factors = [[x1_min, x1_max], [x2_min, x2_max], [x3_min, x3_max], [x4_min, x4_max], [x5_min, x5_max], [x6_min, x6_max]]
 
 	print ("PFE")
-	pfe = PFE(min_max_factors, times)
+	# experiments of the DFE are corners the PFE already simulated, they are taken from the store
+	store = {}
+	pfe = PFE(min_max_factors, times, workers = os.cpu_count(), store = store)
 	pfe.fill_experiment_data()
 	pfe.printtable()
 	pfe.fill_calculated_data()
@@ -520,7 +721,7 @@ if __name__ == "__main__":
 	pfe.check_adequacy()
 
 	print ("DFE")
-	dfe = DFE(min_max_factors, times, 2)
+	dfe = DFE(min_max_factors, times, 2, workers = os.cpu_count(), store = store)
 	dfe.fill_experiment_data()
 	dfe.printtable()
 	dfe.fill_calculated_data()
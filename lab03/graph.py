@@ -1,49 +1,18 @@
-import model
-import math
+import sweep
+import os
+import sys
 import matplotlib.pyplot as plt
 
-def getGraph():
-	print("loadness,", "x1,", "x2,", "x3,", "x4,", "x5,", "x6,", "sigma1,", "a1,", "b1,", "sigma2,", "a2,", "b2,", "avg_await_time")
-	start_time = 0
-	stop_time = 20
-	times = 5
+# the grid is simulated by sweep.sweep, points are written to path (data.csv by default)
+# and an interrupted run started again continues from its last checkpoint
+# truncate_warmup drops the start transient of the runs, engine = 'analytic' gives the approximation
+# instead of simulating and screen = (low, high) simulates only the points with the approximation within it,
+# points are taken from the result cache at the path cache when they were simulated before
+def getGraph(path = "data.csv", seed = None, workers = os.cpu_count(), truncate_warmup = False, engine = 'lockstep', screen = None, cache = None):
+	sweep.sweep(path, sweep.GRAPH_RANGES, seed, workers, truncate_warmup = truncate_warmup, engine = engine, screen = screen, cache = cache)
 
-	x1 = 0.1
-	while x1 <= 0.156:
-		x2 = 0.17
-		while x2 <= 0.5:
-			x3 = 0.1
-			while x3 <= 0.5:
-				x4 = 0.08
-				while x4 <= 0.1:
-					x5 = 0.125
-					while x5 <= 0.25:
-						x6 = 0.5
-						while x6 <= 1:
-							ro = (x1 + x4) / ((x2 + x5) / 2)
-							sigma1 =  1 / x1 * math.sqrt(2 / math.pi)
-							a1 = 1/x2 - x3 * math.sqrt(3)
-							b1 = 1/x2 + x3 * math.sqrt(3)
-							sigma2 =  1 / x4 * math.sqrt(2 / math.pi)
-							a2 = 1/x5 - x6 * math.sqrt(3)
-							b2 = 1/x5 + x6 * math.sqrt(3)
-							if (ro <= 1):
-								if (a1 >= 0 and b1 >= 0 and a1 < b1 and sigma1 >= 0 and a2 >= 0 and b2 >= 0 and a2 < b2 and sigma2 >= 0):
-									m = model.Model(start_time, stop_time, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
-									avg_wait_time = m.calculate(times)
-									if (avg_wait_time < 0):
-										avg_wait_time = m.calculate(times)
-									if (avg_wait_time < 0):
-										avg_wait_time = m.calculate(times)
-									if (avg_wait_time < 0):
-										avg_wait_time = m.calculate(times)
-									if (avg_wait_time >= 0):
-										print(ro, ",", x1, ",", x2, ",", x3, ",", x4, ",", x5, ",", x6, ",", sigma1, ",", a1, ",", b1, ",", sigma2, ",", a2, ",", b2, ",", avg_wait_time)
-							x6 += 0.1
-						x5 += 0.01
-					x4 += 0.005
-				x3 += 0.1
-			x2 += 0.05
-		x1 += 0.01
-
-getGraph()
+if __name__ == "__main__":
+	if (len(sys.argv) > 1):
+		getGraph(sys.argv[1])
+	else:
+		getGraph()
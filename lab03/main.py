@@ -1,10 +1,12 @@
 import random
 import numpy
 import math
+from collections import deque
 import matplotlib.pyplot as plt
 from prettytable import PrettyTable
 from itertools import combinations
 from scipy import stats
+from model import InverseStream, Statistics, BatchMeans, parallel_replications, more_replications
 
 def increment(elem):
 	elem += 1
@@ -13,30 +15,70 @@ def increment(elem):
 def get_value(x_min, x_max, prop):
 	return (prop + 1) / 2 * (x_max - x_min) + x_min
 
+# walsh-hadamard transform of y (length 2^k) in place: y[mask] becomes the sum of y[row] with the sign
+# (-1)^(number of bits set in both row and mask). k passes of sums and differences of pairs h apart,
+# so all the effects of a full plan take O(N log N) and none of its columns is built
+def fwht(y):
+	h = 1
+	while (h < len(y)):
+		pairs = y.reshape(-1, 2, h)
+		first = pairs[:, 0].copy()
+		pairs[:, 0] += pairs[:, 1]
+		pairs[:, 1] = first - pairs[:, 1]
+		h *= 2
+	return y
+
+# times are drawn in blocks of block_size values, one numpy call per block
 class Generator:
-	def __init__(self, sigma):
+	def __init__(self, sigma, block_size = 1024):
 		assert(sigma >= 0)
 		self.scale = sigma
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		nparray = numpy.random.rayleigh(self.scale, 1)
-		return nparray[0]
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.rayleigh(self.scale, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class Operator:
-	def __init__(self, a, b):
+	def __init__(self, a, b, block_size = 1024):
 		assert(a >= 0 and b >= 0 and a < b)
 		self.busy = False
 		self.low = a
 		self.high = b
+		self.block_size = block_size
+		self.set_rng(numpy.random.default_rng())
+
+	def set_rng(self, rng):
+		self.rng = rng
+		self.block = []
+		self.block_index = 0
 
 	def generate_time(self):
-		return random.uniform(self.low, self.high)
+		if (self.block_index == len(self.block)):
+			self.block = self.rng.uniform(self.low, self.high, self.block_size).tolist()
+			self.block_index = 0
+		self.block_index += 1
+		return self.block[self.block_index - 1]
 
 class System:
-	def __init__(self, start_time = 0, end_time = 20):
+	def __init__(self, start_time = 0, end_time = 20, block_size = 1024, seed = None):
 		assert(start_time >= 0 and end_time >= 0 and end_time > start_time)
 		self.start_time = start_time
 		self.end_time = end_time
+		self.block_size = block_size
+		if (isinstance(seed, numpy.random.SeedSequence)):
+			self.seed_sequence = seed
+		else:
+			self.seed_sequence = numpy.random.SeedSequence(seed)
 
 		self.queue_length = 0
 		self.max_queue_length = 0
@@ -46,11 +88,13 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
+		self.batch_means = None
 
 	def set_generators_by_params(self, generators_conf_array = [4]):
 		assert(len(generators_conf_array) != 0)
 		self.generators_number = len(generators_conf_array)
-		self.generators = [Generator(generators_conf_array[i]) for i in range (self.generators_number)]
+		self.generators = [Generator(generators_conf_array[i], self.block_size) for i in range (self.generators_number)]
 
 	def set_generators_by_intensity(self, generators_conf_array = [2]):
 		assert(len(generators_conf_array) != 0)
@@ -58,11 +102,11 @@ class System:
 		self.generators = []
 		for i in range (self.generators_number):
 			sigma = 1/generators_conf_array[i] * math.sqrt(2 / math.pi)
-			self.generators.append(Generator(sigma))
+			self.generators.append(Generator(sigma, self.block_size))
 
 	def set_operators_by_params(self, operators_conf_array = [[0, 2]]):
 		self.operators_number = len(operators_conf_array)
-		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1]) for i in range(self.operators_number)]
+		self.operators = [Operator(operators_conf_array[i][0], operators_conf_array[i][1], self.block_size) for i in range(self.operators_number)]
 
 	def set_operators_by_intensity_and_dispersion(self, operators_conf_array = [[5, 0.3]]):
 		self.operators_number = len(operators_conf_array)
@@ -71,7 +115,7 @@ class System:
 			a = 1/operators_conf_array[i][0] - operators_conf_array[i][1] * math.sqrt(3)
 			b = 1/operators_conf_array[i][0] + operators_conf_array[i][1] * math.sqrt(3)
 			assert(a >= 0 and b >= 0 and a < b)
-			self.operators.append(Operator(a, b))
+			self.operators.append(Operator(a, b, self.block_size))
 
 	def reset(self):
 		self.queue_length = 0
@@ -82,16 +126,30 @@ class System:
 		self.started_processing = 0
 		self.max_waiting_time = 0
 		self.events = list()
+		self.waiting = deque()
 		for op in self.operators:
 			op.busy = False
 
+	# every generator and operator draws from its own stream spawned from seed
+	# antithetic False or True gives inverse transform streams of U or 1 - U (InverseStream)
+	def seed_streams(self, seed, antithetic = None):
+		streams = [numpy.random.default_rng(child) for child in seed.spawn(self.generators_number + self.operators_number)]
+		if (antithetic is not None):
+			streams = [InverseStream(stream, antithetic) for stream in streams]
+		for i in range(self.generators_number):
+			self.generators[i].set_rng(streams[i])
+		for i in range(self.operators_number):
+			self.operators[i].set_rng(streams[self.generators_number + i])
+
 	def add_event(self, event: list):
 		i = 0
 		while i < len(self.events) and self.events[i][0] <= event[0]:
 			i += 1
 		self.events.insert(i, event)
 
+	# stats keeps the Statistics of the last run
 	def modeling(self):
+		self.stats = Statistics(self.start_time, self.operators_number)
 		for i in range(self.generators_number):
 			self.add_event([self.start_time, 'client', i, 0])
 			self.generated += 1
@@ -106,6 +164,7 @@ class System:
 				self.start_operate(event)
 			else: # if event[1] == 'operator':
 				self.finish_operate(event)
+		self.stats.change(max(self.end_time, self.stats.time), 0, 0)
 		self.avg_waiting_time /= self.started_processing
 
 	def start_operate(self, event):
@@ -113,46 +172,70 @@ class System:
 		while i < self.operators_number and self.operators[i].busy:
 			i += 1
 		if i != self.operators_number:
-			self.queue_length -= 1
-			self.operators[i].busy = True
-			self.add_event([event[0] + self.operators[i].generate_time(), 'operator', i])
-			self.started_processing += 1
-			self.avg_waiting_time += event[3]
-			if (event[3] > self.max_waiting_time):
-				self.max_waiting_time = event[3]
+			self.stats.change(event[0], 0, 1)
+			self.take_client(i, event[0], event[3])
 		else:
-			j = 0
-			while j < len(self.events) and self.events[j][1] != 'operator':
-				j += 1
-			self.add_event([self.events[j][0], 'client', event[2], event[3] + self.events[j][0] - event[0]])
-		if (event[3] == 0):
-			self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
-			self.generated += 1
-			self.queue_length += 1
-			if (self.queue_length > self.max_queue_length):
-				self.max_queue_length = self.queue_length
+			# all operators are busy, the client waits in line
+			self.stats.change(event[0], 1, 0)
+			self.waiting.append(event)
+		self.add_event([event[0] + self.generators[event[2]].generate_time(), 'client', event[2], 0])
+		self.generated += 1
+		self.queue_length += 1
+		if (self.queue_length > self.max_queue_length):
+			self.max_queue_length = self.queue_length
+
+	def take_client(self, i, time, waiting_time):
+		self.queue_length -= 1
+		self.operators[i].busy = True
+		self.add_event([time + self.operators[i].generate_time(), 'operator', i])
+		self.started_processing += 1
+		self.avg_waiting_time += waiting_time
+		self.stats.add_wait(waiting_time)
+		if (self.batch_means is not None):
+			self.batch_means.add(waiting_time)
+		if (waiting_time > self.max_waiting_time):
+			self.max_waiting_time = waiting_time
 
 	def finish_operate(self, event):
 		self.operators[event[2]].busy = False
+		self.stats.change(event[0], 0, -1)
 		self.processed += 1
+		if (len(self.waiting) > 0 and event[0] < self.end_time):
+			client = self.waiting.popleft()
+			self.stats.change(event[0], -1, 1)
+			self.take_client(event[2], event[0], event[0] - client[0])
+
+	# batch means of the waiting times of one run of run_length instead of independent replications,
+	# the start transient is paid once
+	def batch_calculate(self, run_length, batches = 32, max_correlation = 0.1, min_batches = 8):
+		end_time = self.end_time
+		self.end_time = self.start_time + run_length
+		self.batch_means = BatchMeans(batches)
+		self.seed_streams(self.seed_sequence.spawn(1)[0])
+		self.modeling()
+		avg = self.batch_means.means(max_correlation, min_batches)
+		self.batch_means = None
+		self.end_time = end_time
+		self.reset()
+		return avg
 
-	def getStat(self, times):
-		waiting_time_arr = []
-		for i in range(times):
-			self.modeling()
-			waiting_time_arr.append(self.avg_waiting_time)
-			self.reset()
-		return waiting_time_arr
+	# run_statistics gets the Statistics of every run, both runs of a pair with antithetic
+	def getStat(self, times, workers = 1, half_width = None, max_times = 100, antithetic = False):
+		runs = parallel_replications(self, self.seed_sequence.spawn(times), workers, antithetic)
+		runs = more_replications(self, runs, times, workers, half_width, max_times, lambda run: run[0], antithetic)
+		self.run_statistics = [stats for run in runs for stats in run[1]]
+		return [run[0] for run in runs]
 
 class PFE:
 	# [[m1_min, m1_max], [m2_min, m2_max], [sigma2_min, sigma2_max]]
-	def __init__ (self, min_max_factors, times):
+	def __init__ (self, min_max_factors, times, seed = None):
 		self.factors = min_max_factors
 		self.number_of_factors = len(min_max_factors)
 		self.number_of_experiments = 2 ** self.number_of_factors
 		self.create_real_table(min_max_factors)
 		self.create_plan_table()
 		self.times = times
+		self.seed = seed
 		self.experiment_data_filled = False
 		self.calculated_data_filled = False
 
@@ -197,7 +280,7 @@ class PFE:
 
 	def fill_experiment_data(self):
 		self.experiment_data_filled = True
-		model = System(0, 20)
+		model = System(0, 20, seed = self.seed)
 		sumdisppersion = 0
 		maxdispersion = 0
 		for experiment in range (self.number_of_experiments):
@@ -223,10 +306,11 @@ class PFE:
 
 	def calculate_koefs(self):
 		self.koefs = []
-		y_ex_avg_sum = 0
-		for experiment in range(self.number_of_experiments):
-			y_ex_avg_sum += self.real_table[experiment][self.number_of_factors]
-		self.koefs.append(y_ex_avg_sum / self.number_of_experiments) #a0
+		# effects[mask] is the coefficient of the product of the factors of the bits of mask, factor f is
+		# -1 in the rows of create_plan_table with bit f set. mask_koefs keeps the significant ones by mask
+		effects = fwht(numpy.array([row[self.number_of_factors] for row in self.real_table], dtype = float)) / self.number_of_experiments
+		self.mask_koefs = numpy.zeros(self.number_of_experiments)
+		self.koefs.append(effects[0].item()) #a0
 		koef_meaning = abs(self.koefs[0])/self.Sak
 		print("Критерий Стьюдента: ", self.student_table)
 		if (koef_meaning >= self.student_table):
@@ -237,19 +321,15 @@ class PFE:
 		print ("a 0\t", round(self.koefs[0], 7), "\t", round(koef_meaning, 7), end = ending)
 		if (koef_meaning < self.student_table):
 			self.koefs[0] = 0
+		self.mask_koefs[0] = self.koefs[0]
 
 		factor_indexes = []
 		for i in range (self.number_of_factors):
 			factor_indexes.append(i)
 		for i in range (1, self.number_of_factors + 1):
 			for j in combinations(factor_indexes, i):
-				koef_value = 0
-				for experiment in range(self.number_of_experiments):
-					mult = 1
-					for k in range(i):
-						mult *= self.plan_table[experiment][j[k]]
-					koef_value += mult * self.real_table[experiment][self.number_of_factors]
-				koef_value /= self.number_of_experiments
+				mask = sum([1 << k for k in j])
+				koef_value = effects[mask].item()
 				koef_meaning = abs(koef_value)/self.Sak
 				if (koef_meaning >= self.student_table):
 					ending = "\t✓\n"
@@ -260,6 +340,7 @@ class PFE:
 				if (koef_meaning < self.student_table):
 					koef_value = 0
 				self.koefs.append(koef_value)
+				self.mask_koefs[mask] = koef_value
 
 	def calculate_partly_nonlinear(self, factors):
 		result = self.koefs[0]
@@ -283,8 +364,10 @@ class PFE:
 	def fill_calculated_data(self):
 		self.calculate_koefs()
 		self.calculated_data_filled = True
+		# the partly nonlinear model in all the rows of the plan is the transform of its coefficients by mask
+		y_cal_values_non = fwht(self.mask_koefs.copy())
 		for experiment in range (self.number_of_experiments):
-			y_cal_value_non = self.calculate_partly_nonlinear(self.plan_table[experiment])
+			y_cal_value_non = y_cal_values_non[experiment].item()
 			y_cal_value = self.calculate_linear(self.plan_table[experiment])
 			self.real_table[experiment].append(y_cal_value)
 			self.real_table[experiment].append(y_cal_value_non)
@@ -334,7 +417,7 @@ class PFE:
 		print(pt)
 
 class DFE:
-	def __init__ (self, min_max_factors, times, p):
+	def __init__ (self, min_max_factors, times, p, seed = None):
 		self.factors = min_max_factors
 		self.number_of_factors = len(min_max_factors)
 		self.p = p
@@ -342,6 +425,7 @@ class DFE:
 		self.create_plan_table()
 		self.create_real_table(min_max_factors)
 		self.times = times
+		self.seed = seed
 		self.experiment_data_filled = False
 		self.calculated_data_filled = False
 
@@ -389,7 +473,7 @@ class DFE:
 
 	def fill_experiment_data(self):
 		self.experiment_data_filled = True
-		model = System(0, 20)
+		model = System(0, 20, seed = self.seed)
 		sumdisppersion = 0
 		maxdispersion = 0
 		for experiment in range (self.number_of_experiments):
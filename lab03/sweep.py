@@ -0,0 +1,157 @@
+import model
+import os
+import json
+import math
+import numpy
+import concurrent.futures
+from collections import deque
+
+# (start, stop, step) of x1..x6, the grid getGraph used to walk with nested loops
+GRAPH_RANGES = [[0.1, 0.156, 0.01], [0.17, 0.5, 0.05], [0.1, 0.5, 0.1], [0.08, 0.1, 0.005], [0.125, 0.25, 0.01], [0.5, 1, 0.1]]
+HEADER = ["loadness", "x1", "x2", "x3", "x4", "x5", "x6", "sigma1", "a1", "b1", "sigma2", "a2", "b2", "avg_await_time", "status"]
+
+# values are accumulated the same way the nested while loops did, so the grid gets the same floats
+def factor_values(start, stop, step):
+	values = []
+	x = start
+	while x <= stop:
+		values.append(x)
+		x += step
+	return values
+
+# derived model parameters of the points, works on whole arrays and on broadcast mesh axes alike
+def point_params(x1, x2, x3, x4, x5, x6):
+	ro = (x1 + x4) / ((x2 + x5) / 2)
+	sigma1 =  1 / x1 * math.sqrt(2 / math.pi)
+	a1 = 1/x2 - x3 * math.sqrt(3)
+	b1 = 1/x2 + x3 * math.sqrt(3)
+	sigma2 =  1 / x4 * math.sqrt(2 / math.pi)
+	a2 = 1/x5 - x6 * math.sqrt(3)
+	b2 = 1/x5 + x6 * math.sqrt(3)
+	return ro, sigma1, a1, b1, sigma2, a2, b2
+
+# feasibility mask of the whole grid from a sparse mesh, x1 changes slowest like in the nested loops
+# returns grid indexes of the feasible points and their rows of ro, x1..x6, sigma1, a1, b1, sigma2, a2, b2
+def feasible_points(ranges):
+	values = [numpy.array(factor_values(*factor_range)) for factor_range in ranges]
+	ro, sigma1, a1, b1, sigma2, a2, b2 = point_params(*numpy.meshgrid(*values, indexing = 'ij', sparse = True))
+	mask = (ro <= 1) & (a1 >= 0) & (b1 >= 0) & (a1 < b1) & (sigma1 > 0) & (a2 >= 0) & (b2 >= 0) & (a2 < b2) & (sigma2 > 0)
+	indexes = numpy.flatnonzero(mask)
+	x = [values[i][axis] for i, axis in enumerate(numpy.unravel_index(indexes, mask.shape))]
+	ro, sigma1, a1, b1, sigma2, a2, b2 = point_params(*x)
+	return indexes, numpy.column_stack([ro] + x + [sigma1, a1, b1, sigma2, a2, b2])
+
+# which of the points (rows of feasible_points) have the analytic approximation of the waiting time
+# (model.analytic_wait) within [low, high], computed for all of them at once
+def screened_points(params, low, high):
+	wait = model.analytic_wait([[params[:, 7], params[:, 8], params[:, 9]], [params[:, 10], params[:, 11], params[:, 12]]])
+	return (wait >= low) & (wait <= high)
+
+# csv line of one feasible grid point and its status (Model.statuses), 'unstable' if some run did not drain,
+# its average waiting time is then -1. the point gets its own seed made from the sweep seed and its index in the grid
+def point_line(index, params, seed, start_time, end_time, times, truncate_warmup = False, engine = 'lockstep', cache = None):
+	sigma1, a1, b1, sigma2, a2, b2 = params[7:]
+	seed_sequence = numpy.random.SeedSequence(seed, spawn_key = (index,))
+	m = model.Model(start_time, end_time, [[sigma1, a1, b1], [sigma2, a2, b2]], 1, engine, seed = seed_sequence, truncate_warmup = truncate_warmup, cache = cache)
+	avg_wait_time = m.calculate(times)
+	status = 'stable'
+	if ('unstable' in m.statuses):
+		status = 'unstable'
+		avg_wait_time = -1
+	return " , ".join(map(str, params + [avg_wait_time, status])) + "\n", status
+
+# checkpoint is a json object: the sweep seed, number of grid points written to path, the size of path
+# after them and the settings the lines were made with (sweep_settings)
+def read_checkpoint(checkpoint_path):
+	with open(checkpoint_path) as checkpoint:
+		state = json.load(checkpoint)
+	return state["seed"], state["points_done"], state["offset"], state["settings"]
+
+def write_checkpoint(checkpoint_path, seed, points_done, offset, settings):
+	with open(checkpoint_path + ".tmp", "w") as checkpoint:
+		json.dump({"seed": seed, "points_done": points_done, "offset": offset, "settings": settings}, checkpoint)
+		checkpoint.write("\n")
+		checkpoint.flush()
+		os.fsync(checkpoint.fileno())
+	os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+# results of function(*task) in the order of tasks, at most ahead tasks are submitted to the pool at once
+def ordered_results(pool, function, tasks, ahead):
+	pending = deque()
+	for task in tasks:
+		pending.append(pool.submit(function, *task))
+		if (len(pending) >= ahead):
+			yield pending.popleft().result()
+	while (len(pending) > 0):
+		yield pending.popleft().result()
+
+# simulates every grid point on workers processes and writes csv lines to path in grid order
+# every checkpoint_every simulated points the written lines are synced and path.checkpoint is updated,
+# an interrupted sweep started again with the same path continues after the last checkpoint
+# and gives the same file as an uninterrupted one
+# with truncate_warmup the start transient of every run is dropped (model.mser)
+# engine is the engine of model.Model, 'analytic' gives the whole grid without simulating it.
+# with screen = (low, high) only the points with the analytic waiting time within it are simulated
+# cache is the path of the result cache of the points (cache.Cache)
+# settings of sweep that change the lines it writes, as they are read back from the checkpoint
+# (json makes tuples lists). workers, checkpoint_every and cache don't change them
+def sweep_settings(ranges, start_time, end_time, times, truncate_warmup, engine, screen):
+	return json.loads(json.dumps({"ranges": ranges, "start_time": start_time, "end_time": end_time, "times": times, "truncate_warmup": truncate_warmup, "engine": engine, "screen": screen}))
+
+# seed is an int, the entropy of the sweep seed sequence, it is kept in the checkpoint as it is.
+# a checkpoint made with other settings is not continued, the old lines would not match the new ones.
+# every simulated point gets a line with its status, the points that are not feasible or are screened out get none.
+# returns the number of points simulated by this call and how many of them were unstable
+def sweep(path, ranges = GRAPH_RANGES, seed = None, workers = 1, start_time = 0, end_time = 20, times = 5, checkpoint_every = 64, truncate_warmup = False, engine = 'lockstep', screen = None, cache = None):
+	checkpoint_path = path + ".checkpoint"
+	settings = sweep_settings(ranges, start_time, end_time, times, truncate_warmup, engine, screen)
+	if (os.path.exists(checkpoint_path)):
+		seed, points_done, offset, checkpoint_settings = read_checkpoint(checkpoint_path)
+		assert(checkpoint_settings == settings)
+		output = open(path, "r+b")
+		output.truncate(offset)
+		output.seek(offset)
+	else:
+		if (seed is None):
+			seed = numpy.random.SeedSequence().entropy
+		assert(isinstance(seed, int))
+		points_done = 0
+		output = open(path, "wb")
+		output.write((", ".join(HEADER) + "\n").encode())
+		output.flush()
+		write_checkpoint(checkpoint_path, seed, points_done, output.tell(), settings)
+
+	# only feasible points are simulated, points_done counts grid points so it does not depend on the mask
+	indexes, params = feasible_points(ranges)
+	if (screen is not None):
+		interesting = screened_points(params, *screen)
+		indexes = indexes[interesting]
+		params = params[interesting]
+	left = indexes >= points_done
+	indexes = indexes[left]
+	params = params[left]
+	tasks = ((indexes[i].item(), params[i].tolist(), seed, start_time, end_time, times, truncate_warmup, engine, cache) for i in range(len(indexes)))
+
+	pool = None
+	if (workers > 1):
+		pool = concurrent.futures.ProcessPoolExecutor(max_workers = workers)
+		lines = ordered_results(pool, point_line, tasks, 4 * workers)
+	else:
+		lines = (point_line(*task) for task in tasks)
+	unstable = 0
+	try:
+		for done, (line, status) in enumerate(lines, 1):
+			output.write(line.encode())
+			if (status == 'unstable'):
+				unstable += 1
+			points_done = indexes[done - 1].item() + 1
+			if (done % checkpoint_every == 0):
+				output.flush()
+				os.fsync(output.fileno())
+				write_checkpoint(checkpoint_path, seed, points_done, output.tell(), settings)
+	finally:
+		if (pool is not None):
+			pool.shutdown(cancel_futures = True)
+		output.close()
+	os.remove(checkpoint_path)
+	return len(indexes), unstable
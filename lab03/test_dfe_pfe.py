@@ -0,0 +1,26 @@
+import pytest
+from dfe_pfe import DFE, check_generators, defining_relation, word_mask
+
+FACTORS = [[0.1, 0.2], [0.6, 0.8], [0.03, 0.1], [0.125, 0.4], [0.9, 1.1], [0.05, 0.15]]
+
+def test_duplicate_generators_are_rejected():
+	with pytest.raises(ValueError):
+		check_generators(6, 2, [[1, 2], [1, 2]])
+	with pytest.raises(ValueError):
+		DFE(FACTORS, 5, 2, generators = [[1, 2], [1, 2]])
+
+def test_generators_with_dependent_base_factors_keep_main_effects_apart():
+	# x4 = x1x2, x5 = x1x3, x6 = x2x3: x1x2 * x1x3 = x2x3, the defining relation still has no word shorter than 3
+	generators = [[1, 2], [1, 3], [2, 3]]
+	check_generators(6, 3, generators)
+	assert(min(bin(word).count("1") for word in defining_relation(6, 3, generators)[1:]) == 3)
+	dfe = DFE(FACTORS, 5, 3, generators = generators)
+	mains = [word_mask([factor], 6) for factor in range(1, 7)]
+	assert(dfe.koef_masks[1:7] == mains)
+	assert(len(set(dfe.column(mask) for mask in mains)) == 6)
+
+def test_default_and_auto_generators_pass():
+	for p in (1, 2):
+		DFE(FACTORS, 5, p)
+	for p in (1, 2, 3):
+		DFE(FACTORS, 5, p, generators = 'auto')
@@ -1,6 +1,16 @@
 import numpy
-import random
+import warnings
 import math
+import heapq
+import itertools
+import concurrent.futures
+import scipy.stats
+import cache
+from array import array
+from collections import deque
+
+# part of the key of cached results, to be changed when a change of the engines changes their results
+CACHE_VERSION = 1
 
 class Task:
 	def __init__(self, arrive_time, operate_time, gen_id):
@@ -31,16 +41,36 @@ class Event:
 		self.time = time
 		self.task = task
 
+# random stream that draws rayleigh and uniform times by inverse transform of its uniforms U,
+# or of 1 - U for the antithetic run of a pair, so the two runs get negatively correlated times
+class InverseStream:
+	def __init__(self, rng, antithetic = False):
+		self.rng = rng
+		self.antithetic = antithetic
+
+	def uniforms(self, size):
+		u = self.rng.random(size)
+		if (self.antithetic):
+			return 1 - u
+		return u
+
+	def rayleigh(self, sigma, size):
+		return sigma * numpy.sqrt(-2 * numpy.log1p(-self.uniforms(size)))
+
+	def uniform(self, a, b, size):
+		return a + (b - a) * self.uniforms(size)
+
+# arrival and operate times are drawn in blocks of block_size values, one numpy call per block
 class Generator:
-	def __init__(self, params, id, start_time):
+	def __init__(self, params, id, start_time, block_size = 1024):
 		self.sigma = params[0]
 		self.a = params[1]
 		self.b = params[2]
 		try:
-			assert(self.sigma >= 0)
+			assert(self.sigma > 0)
 		except AssertionError:
 			print(self.sigma)
-			assert(self.sigma >= 0)
+			assert(self.sigma > 0)
 
 		try:
 			assert(self.a >= 0 and self.b >= 0 and self.a < self.b)
@@ -49,14 +79,380 @@ class Generator:
 			assert(self.a >= 0 and self.b >= 0 and self.a < self.b)
 		self.id = id
 		self.time = start_time
+		self.block_size = block_size
+		self.arrive_mean = self.sigma * math.sqrt(math.pi / 2)
+		self.operate_mean = (self.a + self.b) / 2
+		self.set_streams(numpy.random.default_rng(), numpy.random.default_rng())
+
+	# arrival times and operate times come from two separate random streams
+	def set_streams(self, arrive_rng, operate_rng):
+		self.arrive_rng = arrive_rng
+		self.operate_rng = operate_rng
+		self.arrive_block = []
+		self.operate_block = []
+		self.block_index = 0
+
+	def refill(self):
+		self.arrive_block = self.arrive_rng.rayleigh(self.sigma, self.block_size).tolist()
+		self.operate_block = self.operate_rng.uniform(self.a, self.b, self.block_size).tolist()
+		self.block_index = 0
 
 	def generate_new_task(self):
-		arrivetimes = numpy.random.rayleigh(self.sigma, 1)
-		self.time += arrivetimes[0]
-		operatetime = random.uniform(self.a, self.b)
+		if (self.block_index == len(self.arrive_block)):
+			self.refill()
+		self.time += self.arrive_block[self.block_index]
+		operatetime = self.operate_block[self.block_index]
+		self.block_index += 1
 		task = Task(self.time, operatetime, self.id)
 		return task
 
+	# tasks of several independent runs at once, one row per run and its (arrive_rng, operate_rng)
+	# every row is generated at least up to end_time and padded with end_time, later arrivals are left to the caller
+	# a row gets the same values generate_new_task would give with the same streams
+	def generate_streams(self, streams, end_time):
+		size = int((end_time - self.time) / self.arrive_mean * 1.2) + 16
+		rows = []
+		for arrive_rng, operate_rng in streams:
+			arrivetimes = numpy.cumsum(numpy.concatenate(([self.time], arrive_rng.rayleigh(self.sigma, size))))[1:]
+			while (arrivetimes[-1] < end_time):
+				more = numpy.cumsum(numpy.concatenate(([arrivetimes[-1]], arrive_rng.rayleigh(self.sigma, size))))[1:]
+				arrivetimes = numpy.concatenate((arrivetimes, more))
+			rows.append((arrivetimes, operate_rng.uniform(self.a, self.b, len(arrivetimes))))
+		width = max(len(row[0]) for row in rows)
+		arrivetimes = numpy.full((len(rows), width), float(end_time))
+		operatetimes = numpy.zeros((len(rows), width))
+		for i in range(len(rows)):
+			arrivetimes[i, :len(rows[i][0])] = rows[i][0]
+			operatetimes[i, :len(rows[i][1])] = rows[i][1]
+		return arrivetimes, operatetimes
+
+	# control variates of the rows of generate_streams with known zero means: the sum of interarrival times
+	# up to the first arrival at or after end_time (Wald) and the sum of operate times of the tasks
+	# that arrived before end_time, both minus their known means
+	def controls(self, arrivetimes, operatetimes, end_time):
+		arrived = (arrivetimes < end_time).sum(axis = 1)
+		last = numpy.take_along_axis(arrivetimes, arrived[:, None], axis = 1)[:, 0]
+		work = numpy.cumsum(numpy.where(arrivetimes < end_time, operatetimes, 0), axis = 1)[:, -1]
+		return numpy.column_stack((last - self.time - (arrived + 1) * self.arrive_mean, work - arrived * self.operate_mean))
+
+# streaming estimate of the p quantile with five markers (P-square algorithm), memory doesn't grow with the data
+class P2Quantile:
+	def __init__(self, p):
+		self.p = p
+		self.heights = []
+		self.positions = [1, 2, 3, 4, 5]
+		self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+		self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+	def add(self, x):
+		q = self.heights
+		n = self.positions
+		if (len(q) < 5):
+			q.append(x)
+			q.sort()
+			return
+		if (x < q[0]):
+			q[0] = x
+			k = 0
+		elif (x >= q[4]):
+			q[4] = x
+			k = 3
+		else:
+			k = 0
+			while (x >= q[k + 1]):
+				k += 1
+		for i in range(k + 1, 5):
+			n[i] += 1
+		for i in range(5):
+			self.desired[i] += self.increments[i]
+		for i in range(1, 4):
+			d = self.desired[i] - n[i]
+			if ((d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1)):
+				d = 1 if d > 0 else -1
+				height = q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+				if (not q[i - 1] < height < q[i + 1]):
+					height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+				q[i] = height
+				n[i] += d
+
+	def value(self):
+		if (len(self.heights) == 0):
+			return 0
+		if (len(self.heights) < 5):
+			return self.heights[round(self.p * (len(self.heights) - 1))]
+		return self.heights[2]
+
+# statistics of one run in constant memory: mean, variance (Welford), maximum and quantiles of the waiting time,
+# time weighted length of the waiting line and utilisation of the operators
+class Statistics:
+	def __init__(self, start_time = 0, operators_number = 1, probabilities = (0.5, 0.95, 0.99)):
+		self.start_time = start_time
+		self.time = start_time
+		self.operators_number = operators_number
+		self.count = 0
+		self.mean = 0
+		self.m2 = 0
+		self.max = 0
+		self.quantiles = [P2Quantile(p) for p in probabilities]
+		self.queue_length = 0
+		self.busy = 0
+		self.queue_area = 0
+		self.busy_area = 0
+
+	def add_wait(self, wait):
+		self.count += 1
+		delta = wait - self.mean
+		self.mean += delta / self.count
+		self.m2 += delta * (wait - self.mean)
+		if (wait > self.max):
+			self.max = wait
+		for quantile in self.quantiles:
+			quantile.add(wait)
+
+	# the line length and the number of busy operators change at time
+	def change(self, time, queue_change, busy_change):
+		self.queue_area += self.queue_length * (time - self.time)
+		self.busy_area += self.busy * (time - self.time)
+		self.time = time
+		self.queue_length += queue_change
+		self.busy += busy_change
+
+	def variance(self):
+		if (self.count < 2):
+			return 0
+		return self.m2 / (self.count - 1)
+
+	def quantile(self, p):
+		for quantile in self.quantiles:
+			if (quantile.p == p):
+				return quantile.value()
+
+	def mean_queue_length(self, end_time):
+		return (self.queue_area + self.queue_length * (end_time - self.time)) / (end_time - self.start_time)
+
+	def utilisation(self, end_time):
+		return (self.busy_area + self.busy * (end_time - self.time)) / (end_time - self.start_time) / self.operators_number
+
+	def info(self, end_time):
+		print("waiting time mean\t\t", self.mean)
+		print("waiting time variance\t\t", self.variance())
+		print("waiting time max\t\t", self.max)
+		for quantile in self.quantiles:
+			print("waiting time p" + str(round(quantile.p * 100)) + "\t\t", quantile.value())
+		print("mean waiting line length\t", self.mean_queue_length(end_time))
+		print("operators utilisation\t\t", self.utilisation(end_time))
+
+# half width of the Student t confidence interval of the mean of values
+def confidence_half_width(values, confidence = 0.95):
+	n = len(values)
+	if (n < 2):
+		return math.inf
+	mean = sum(values) / n
+	variance = sum([(value - mean) ** 2 for value in values]) / (n - 1)
+	return scipy.stats.t(df = n - 1).ppf((1 + confidence) / 2) * math.sqrt(variance / n)
+
+# number of runs that stands for the runs of all points when they differ (their harmonic mean)
+def mean_runs(run_counts):
+	if (min(run_counts) == max(run_counts)):
+		return run_counts[0]
+	return len(run_counts) / sum([1 / count for count in run_counts])
+
+# lag 1 autocorrelation of values
+def lag_correlation(values):
+	n = len(values)
+	mean = sum(values) / n
+	variance = sum([(value - mean) ** 2 for value in values])
+	if (variance == 0):
+		return 0
+	return sum([(values[i] - mean) * (values[i + 1] - mean) for i in range(n - 1)]) / variance
+
+# means of batches of consecutive waiting times of one long run in constant memory:
+# when there are 2 * batches full batches, neighbours are merged and the batch size doubles
+class BatchMeans:
+	def __init__(self, batches = 32):
+		self.batches = batches
+		self.size = 1
+		self.sums = []
+		self.current = 0
+		self.current_count = 0
+
+	def add(self, value):
+		self.current += value
+		self.current_count += 1
+		if (self.current_count == self.size):
+			self.sums.append(self.current)
+			self.current = 0
+			self.current_count = 0
+			if (len(self.sums) == 2 * self.batches):
+				self.sums = [self.sums[2 * i] + self.sums[2 * i + 1] for i in range(self.batches)]
+				self.size *= 2
+
+	# batches are merged further while their means are correlated, the means can then stand
+	# for the results of independent runs
+	def means(self, max_correlation = 0.1, min_batches = 8):
+		means = [batch_sum / self.size for batch_sum in self.sums]
+		while (len(means) >= 2 * min_batches and abs(lag_correlation(means)) > max_correlation):
+			means = [(means[2 * i] + means[2 * i + 1]) / 2 for i in range(len(means) // 2)]
+		return means
+
+# MSER-5 truncation of the start transient: waiting times are averaged in batches of batch and the first d
+# batches (d at most half of them) are dropped, d is where the rest has the smallest squared error of its mean
+# returns the mean of the waiting times that are left and the number of dropped ones
+def mser(values, batch = 5):
+	values = numpy.asarray(values, dtype = float)
+	n = len(values) // batch
+	if (n < 2):
+		return (values.mean() if len(values) > 0 else 0), 0
+	means = values[:n * batch].reshape(n, batch).mean(axis = 1)
+	left = numpy.arange(n, 0, -1)
+	sums = numpy.cumsum(means[::-1])[::-1]
+	squares = numpy.cumsum((means ** 2)[::-1])[::-1]
+	errors = numpy.maximum(squares - sums ** 2 / left, 0) / left ** 2
+	dropped = int(numpy.argmin(errors[:n // 2 + 1])) * batch
+	return values[dropped:].mean(), dropped
+
+def make_seed_sequence(seed):
+	if (isinstance(seed, numpy.random.SeedSequence)):
+		return seed
+	return numpy.random.SeedSequence(seed)
+
+# approximate steady state average waiting time of the generators [[sigma, a, b], ...] served in one line by
+# operators_number operators (Allen-Cunneen, Kingman for one operator), -1 if the operators are overloaded.
+# rayleigh interarrival times have the squared coefficient of variation (4 - pi) / pi whatever sigma,
+# so the merged arrival stream gets it too, operate time is the mixture of the uniform times weighted by
+# the arrival rates. sigma, a and b may be numpy arrays of points, the result is then an array of them
+def analytic_wait(generators_conf_array, operators_number = 1):
+	rates = [1 / (sigma * math.sqrt(math.pi / 2)) for sigma, a, b in generators_conf_array]
+	rate = sum(rates)
+	operate_mean = sum([r * (a + b) / 2 for r, (sigma, a, b) in zip(rates, generators_conf_array)]) / rate
+	operate_square = sum([r * (a * a + a * b + b * b) / 3 for r, (sigma, a, b) in zip(rates, generators_conf_array)]) / rate
+	variation = (4 - math.pi) / math.pi + operate_square / operate_mean ** 2 - 1
+	load = rate * operate_mean
+	utilisation = numpy.asarray(load / operators_number, dtype = float)
+	with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+		# Erlang C probability that a task has to wait
+		term = 1
+		terms = 1
+		for k in range(1, operators_number):
+			term = term * load / k
+			terms = terms + term
+		last = term * load / operators_number / (1 - utilisation)
+		wait = last / (terms + last) / (operators_number / operate_mean - rate) * variation / 2
+		return numpy.where(utilisation < 1, wait, -1)
+
+# values with their control variates taken out, controls[i] are the controls of values[i] with known zero means.
+# beta is the least squares fit of the values on the controls and every value becomes value - controls * beta,
+# so the mean keeps its expectation and loses the variance the controls explain. Runs that did not
+# drain (-1) are left as they are and with too few runs to fit beta the values are not changed
+def control_adjusted(values, controls):
+	values = numpy.array(values, dtype = float)
+	controls = numpy.array(controls, dtype = float)
+	stable = values != -1
+	if (stable.sum() <= controls.shape[1] + 1):
+		return values.tolist()
+	x = controls[stable]
+	y = values[stable]
+	beta = numpy.linalg.lstsq(x - x.mean(axis = 0), y - y.mean(), rcond = None)[0]
+	values[stable] = y - x @ beta
+	return values.tolist()
+
+# seeds of number design points, every point gets its own one spawned from seed_sequence.
+# with common they all get copies of the same one (common random numbers): run r of every point draws
+# the same standard variates, scaled by the rayleigh and uniform parameters of the point, so the
+# differences between the points are not blurred by independent noise. Copies keep spawning of one
+# point from shifting the seeds of the others when they are run in one process
+def point_seeds(seed_sequence, number, common = False):
+	if (not common):
+		return seed_sequence.spawn(number)
+	seed = seed_sequence.spawn(1)[0]
+	return [seed_copy(seed) for point in range(number)]
+
+# the seed point_seeds(seed_sequence, number, common) gives to point, made without spawning the seeds
+# of the other points and without changing seed_sequence, so large plans can get them a block at a time
+def point_seed(seed_sequence, point, common = False):
+	if (common):
+		point = 0
+	return numpy.random.SeedSequence(seed_sequence.entropy, spawn_key = seed_sequence.spawn_key + (seed_sequence.n_children_spawned + point,), pool_size = seed_sequence.pool_size)
+
+# a seed that spawns the same children as seed did before it spawned any
+def seed_copy(seed):
+	return numpy.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key, pool_size = seed.pool_size)
+
+# waiting times of one operator serving tasks in arrival order (Lindley recursion), one row per run
+# w[n] = max(0, w[n-1] + s[n-1] - (t[n] - t[n-1])) is a random walk reflected at zero
+def lindley(arrive_times, operate_times):
+	walk = numpy.zeros(arrive_times.shape)
+	walk[:, 1:] = numpy.cumsum(operate_times[:, :-1] - numpy.diff(arrive_times, axis = 1), axis = 1)
+	return walk - numpy.minimum.accumulate(walk, axis = 1)
+
+# waiting times of several operators serving tasks in arrival order (Kiefer-Wolfowitz recursion)
+# work holds the time left until each operator gets free, sorted, so a task waits for work[:, 0]
+def kiefer_wolfowitz(arrive_times, operate_times, operators_number):
+	runs, tasks = arrive_times.shape
+	work = numpy.zeros((runs, operators_number))
+	wait_times = numpy.empty((runs, tasks))
+	gaps = numpy.diff(arrive_times, axis = 1)
+	for n in range(tasks):
+		wait_times[:, n] = work[:, 0]
+		work[:, 0] += operate_times[:, n]
+		if (n + 1 < tasks):
+			work -= gaps[:, n, None]
+			numpy.maximum(work, 0, out = work)
+			work.sort(axis = 1)
+	return wait_times
+
+# function(*task) for every task, on a process pool when workers > 1
+# results come in the order of tasks whatever the number of workers
+def pool_map(function, tasks, workers = 1):
+	if (workers <= 1 or len(tasks) <= 1):
+		return [function(*task) for task in tasks]
+	with concurrent.futures.ProcessPoolExecutor(max_workers = min(workers, len(tasks))) as pool:
+		return list(pool.map(function, *zip(*tasks)))
+
+# replications of a System of main.py with the given seeds one after another, average waiting time and statistics
+# of every replication. with antithetic every replication is a pair of runs with the same seed driven by U and 1 - U,
+# its waiting time is their mean and it keeps the statistics of both
+def run_replications(model, seeds, antithetic = False):
+	runs = []
+	for seed in seeds:
+		waiting_times = []
+		statistics = []
+		for inverse in ((False, True) if antithetic else (None,)):
+			model.seed_streams(seed_copy(seed), inverse)
+			model.modeling()
+			waiting_times.append(model.avg_waiting_time)
+			statistics.append(model.stats)
+			model.reset()
+		runs.append((sum(waiting_times) / len(waiting_times), statistics))
+	return runs
+
+# replications are split into one contiguous chunk per worker and run by pool_map
+# every replication keeps its own seed, so the result does not depend on the number of workers
+def parallel_replications(model, seeds, workers = 1, antithetic = False):
+	size = math.ceil(len(seeds) / max(workers, 1))
+	chunks = pool_map(run_replications, [(model, seeds[i:i + size], antithetic) for i in range(0, len(seeds), size)], workers)
+	return [value for chunk in chunks for value in chunk]
+
+# with half_width replications are added times at a time until the half width of the confidence interval
+# of the mean waiting time is below half_width or there are max_times of them
+def more_replications(model, runs, times, workers, half_width, max_times, waiting_time, antithetic = False):
+	while (half_width is not None and len(runs) < max_times and confidence_half_width([waiting_time(run) for run in runs]) > half_width):
+		runs += parallel_replications(model, model.seed_sequence.spawn(min(times, max_times - len(runs))), workers, antithetic)
+	return runs
+
+# waiting times of times runs of one design point, to be run by pool_map
+# with half_width the runs are added times at a time until the mean is that precise or there are max_times of them
+# with run_length the values are batch means of one run that long instead
+# with truncate_warmup every run drops its start transient (mser), with control_variates the values are adjusted by them
+# cache is the path of the result cache of the model or None
+def point_values(start_time, end_time, generators_conf_array, number_of_multioperators, engine, seed, times, half_width = None, max_times = 100, run_length = None, truncate_warmup = False, control_variates = False, cache = None):
+	model = Model(start_time, end_time, generators_conf_array, number_of_multioperators, engine, seed = seed, truncate_warmup = truncate_warmup, control_variates = control_variates, cache = cache)
+	if (run_length is not None):
+		return model.batch_calculate(run_length)
+	if (half_width is None):
+		return model.array_calculate(times)
+	return model.sequential_calculate(half_width, times, max_times)
+
 class Operator:
 	def __init__(self, id):
 		self.id = id
@@ -66,263 +462,522 @@ class Operator:
 		self.busy = True
 		event.task.operate(event.time, self.id)
 		event.time += event.task.operate_time
+		self.free_time = event.time
 		event.task.status = 'done'
 		return event
 
 class Model:
-	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [[4, 0, 2]], number_of_multioperators=1):
+	# engine: 'event' - event by event modeling
+	#         'lindley' - all waiting times of a run at once, only for one operator
+	#         'lockstep' - all runs of array_calculate/calculate at once, one numpy row per run
+	#         'analytic' - no runs, every value is the steady state approximation of analytic_wait
+	# seed: int or numpy.random.SeedSequence, every run gets its own streams spawned from it
+	# collect_statistics: every run also fills a Statistics, replicate keeps them in run_statistics
+	# truncate_warmup: waiting times of a run are kept and its average is taken after the start transient (mser)
+	# control_variates: values of array_calculate and sequential_calculate are adjusted by the known means
+	#                   of the interarrival and operate times (control_adjusted)
+	# cache: path of an sqlite file (cache.Cache), replicate takes the runs it already made with the same
+	#        parameters and seed from there instead of running them again
+	def __init__(self, start_time = 0, end_time = 20, generators_conf_array = [[4, 0, 2]], number_of_multioperators=1, engine = 'event', block_size = 1024, seed = None, collect_statistics = False, truncate_warmup = False, control_variates = False, cache = None):
 		assert(start_time >= 0 and end_time >= 0 and end_time > start_time)
 		self.start_time = start_time
 		self.end_time = end_time
 
 		assert(len(generators_conf_array) != 0)
 		self.generators_number = len(generators_conf_array)
-		self.generators = [Generator(generators_conf_array[i], i, self.start_time) for i in range (self.generators_number)]
+		self.generators = [Generator(generators_conf_array[i], i, self.start_time, block_size) for i in range (self.generators_number)]
 
 		assert(number_of_multioperators > 0)
 		self.operators_number = number_of_multioperators
 		self.operators = [Operator(i) for i in range(self.operators_number)]
 
+		assert(engine in ('event', 'lindley', 'lockstep', 'analytic'))
+		assert(engine != 'lindley' or self.operators_number == 1)
+		self.engine = engine
+		self.max_operate_time = max(gen.b for gen in self.generators)
+		self.seed_sequence = make_seed_sequence(seed)
+		self.collect_statistics = collect_statistics
+		self.truncate_warmup = truncate_warmup
+		self.control_variates = control_variates
+		self.cache = cache
+		self.results_cache = None
+
 		self.avg_waiting_time = 0
 		self.count = 0
 		self.queue = list()
+		self.counter = itertools.count()
+		self.waiting = deque()
+		self.waiting_work = 0
+		self.next_check = 2
+		self.status = 'stable'
+		self.stats = None
+		if (self.collect_statistics):
+			self.stats = Statistics(self.start_time, self.operators_number)
+		self.waits = array('d') if self.truncate_warmup else None
+		self.arrived = [0] * self.generators_number
+		self.arrived_work = [0] * self.generators_number
 
 	def reset(self):
 		self.avg_waiting_time = 0
 		self.count = 0
 		self.queue = list()
+		self.counter = itertools.count()
+		self.waiting = deque()
+		self.waiting_work = 0
+		self.next_check = 2
+		self.status = 'stable'
+		self.stats = None
+		if (self.collect_statistics):
+			self.stats = Statistics(self.start_time, self.operators_number)
+		self.waits = array('d') if self.truncate_warmup else None
+		self.arrived = [0] * self.generators_number
+		self.arrived_work = [0] * self.generators_number
 		for op in self.operators:
 			op.busy = False
 		for gen in self.generators:
 			gen.time = self.start_time
 
+	# queue is a binary heap of (time, seq, event)
+	# seq keeps events with equal time in the order they were added
 	def add_event(self, event):
-		i = 0
-		while i < len(self.queue) and self.queue[i].time <= event.time:
-			i += 1
-		self.queue.insert(i, event)
+		heapq.heappush(self.queue, (event.time, next(self.counter), event))
 
 	def get_event(self):
-		return self.queue.pop(0)
+		return heapq.heappop(self.queue)[2]
 
+	# all operators are busy, the task waits in line until one of them gets free
 	def set_task_wait(self, task):
-		i = 0
-		while i < len(self.queue) and self.queue[i].task.status != 'done':
-			i += 1
-		donetime = self.queue[i].time
-		while i < len(self.queue) and self.queue[i].time == donetime:
-			i += 1
 		task.status = "waits"
-		event = Event(donetime, task)
-		self.queue.insert(i, event)
+		self.waiting.append(task)
+		self.waiting_work += task.operate_time
+		if (self.stats is not None):
+			self.stats.change(task.arrive_time, 1, 0)
 
-	def calculate(self, times, log = 0):
-		avg = 0
-		for time in range(times):
-			for gen in self.generators:
-				task = gen.generate_new_task()
-				event = Event(task.arrive_time, task)
-				if (task.arrive_time < self.end_time):
-					self.add_event(event)
-					if (log):
-						print("\nGENERATE FIRST TASKS")
-						print(event.time)
-						task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-			cur_time = self.start_time
-			while (cur_time < self.end_time and len(self.queue) > 0):
+	def start_task(self, operator, event):
+		if (self.stats is not None):
+			self.stats.change(event.time, -1 if event.task.status == "waits" else 0, 1)
+		event = operator.operate(event)
+		if (self.stats is not None):
+			self.stats.add_wait(event.task.wait_time)
+		if (self.waits is not None):
+			self.waits.append(event.task.wait_time)
+		self.avg_waiting_time += event.task.wait_time
+		self.count += 1
+		self.add_event(event)
+		return event
+
+	# lower bound of the start time of the last but one waiting task: operators take tasks in turn
+	# as soon as they get free, so their free times never differ by more than the longest operate time
+	def start_bound(self, cur_time):
+		work = self.waiting_work - self.waiting[-1].operate_time - self.waiting[-2].operate_time
+		for op in self.operators:
+			if (op.busy):
+				work += op.free_time - cur_time
+		return cur_time + (work - (self.operators_number - 1) * self.max_operate_time) / self.operators_number
+
+	# waiting tasks are served in line by the operators as they get free, so their start times
+	# are already known and tasks that come later can't change them.
+	# if the last but one can't start before end_time, at least two tasks will still be waiting
+	# at the end and the run won't drain whatever happens next
+	def cannot_drain(self, cur_time):
+		free = [op.free_time if op.busy else cur_time for op in self.operators]
+		heapq.heapify(free)
+		for task in itertools.islice(self.waiting, len(self.waiting) - 1):
+			start = heapq.heappop(free)
+			if (start >= self.end_time):
+				return True
+			heapq.heappush(free, start + task.operate_time)
+		return False
+
+	def print_queue(self):
+		print("len queue: ", len(self.queue))
+		print("len waiting line: ", len(self.waiting))
+		print([item[2].time for item in sorted(self.queue, key = lambda item: item[:2])])
+
+	# every generator gets its own streams of arrival and operate times spawned from seed
+	# antithetic False or True gives inverse transform streams of U or 1 - U (InverseStream)
+	def generator_streams(self, seed, antithetic = None):
+		children = seed.spawn(2 * self.generators_number)
+		streams = [numpy.random.default_rng(child) for child in children]
+		if (antithetic is not None):
+			streams = [InverseStream(stream, antithetic) for stream in streams]
+		return [(streams[2 * i], streams[2 * i + 1]) for i in range(self.generators_number)]
+
+	def seed_streams(self, seed, antithetic = None):
+		for gen, streams in zip(self.generators, self.generator_streams(seed, antithetic)):
+			gen.set_streams(*streams)
+
+	# one run of the model, returns average waiting time or -1 if the queue did not drain
+	# status is 'unstable' for such a run, the event engine stops it as soon as it can't drain
+	def modeling(self, log = 0):
+		if (self.engine != 'event'):
+			self.avg_waiting_time = self.lockstep_modeling([[(gen.arrive_rng, gen.operate_rng) for gen in self.generators]])[0]
+			self.status = 'unstable' if self.avg_waiting_time == -1 else 'stable'
+			if (self.collect_statistics):
+				self.stats = self.lockstep_statistics[0]
+			self.controls = self.lockstep_controls[0].tolist()
+			return self.avg_waiting_time
+		for gen in self.generators:
+			task = gen.generate_new_task()
+			event = Event(task.arrive_time, task)
+			if (task.arrive_time < self.end_time):
+				self.add_event(event)
 				if (log):
-					print("\nCUR TIME", cur_time)
-				event = self.get_event()
-				cur_time = event.time
-				if (cur_time > self.end_time):
-					break
+					print("\nGENERATE FIRST TASKS")
+					print(event.time)
+					task.info()
+					self.print_queue()
+		cur_time = self.start_time
+		while (cur_time < self.end_time and len(self.queue) > 0):
+			if (log):
+				print("\nCUR TIME", cur_time)
+			event = self.get_event()
+			cur_time = event.time
+			if (cur_time > self.end_time):
+				break
+			if (log):
+				print("\nPOPPED EVENT")
+				print(event.time)
+				self.print_queue()
+				event.task.info()
+			if (event.task.status == 'new'):
+				gen_id = event.task.gen_id
+				self.arrived[gen_id] += 1
+				self.arrived_work[gen_id] += event.task.operate_time
+				new_task = self.generators[gen_id].generate_new_task()
+				new_event = Event(new_task.arrive_time, new_task)
+				if (new_task.arrive_time < self.end_time):
+					self.add_event(new_event)
+					if (log):
+						print("\nGENERATE NEW TASK")
+						print(new_event.time)
+						new_task.info()
+						self.print_queue()
+			if (event.task.status == 'done'):
 				if (log):
-					print("\nPOPPED EVENT")
+					print("\nPOPPED TASK IS DONE")
 					print(event.time)
-					print("len queue: ", len(self.queue))
-					print(self.queue)
 					event.task.info()
-				if (event.task.status == 'new'):
-					gen_id = event.task.gen_id
-					new_task = self.generators[gen_id].generate_new_task()
-					new_event = Event(new_task.arrive_time, new_task)
-					if (new_task.arrive_time < self.end_time):
-						self.add_event(new_event)
-						if (log):
-							print("\nGENERATE NEW TASK")
-							print(new_event.time)
-							new_task.info()
-							print("len queue: ", len(self.queue))
-							print(self.queue)
-				if (event.task.status == 'done'):
+				operator = self.operators[event.task.op_id]
+				operator.busy = False
+				if (self.stats is not None):
+					self.stats.change(event.time, 0, -1)
+				if (len(self.waiting) > 0 and event.time < self.end_time):
+					event = self.start_task(operator, Event(event.time, self.waiting.popleft()))
+					self.waiting_work -= event.task.operate_time
+					self.next_check = max(2, min(self.next_check, 2 * len(self.waiting)))
 					if (log):
-						print("\nPOPPED TASK IS DONE")
+						print("\nWAITING TASK IS BEING PROCESSED")
 						print(event.time)
 						event.task.info()
-					self.operators[event.task.op_id].busy = False
-					continue
-				i = 0
-				while i < self.operators_number and self.operators[i].busy:
-					i += 1
-				if (i == self.operators_number):
-					self.set_task_wait(event.task)
-					if (log):
-						print("\nTASK IS GOINT TO WAIT")
-						print(event.time)
-						event.task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-				else:
-					event = self.operators[i].operate(event)
-					self.avg_waiting_time += event.task.wait_time
-					self.count += 1
-					self.add_event(event)
-					if (log):
-						print("\nTASK IS BEING PROCESSED")
-						print(event.time)
-						event.task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-				cur_time = self.queue[0].time
-			while (len(self.queue) > 0):
-				if (self.queue[0].task.status == 'done'):
-					if (log):
-						print("\nPOPPING DONE TASKS AFTER MODEL TIME")
-					event = self.queue.pop(0)
-					self.operators[event.task.op_id].busy = False
-				else:
-					break
-			ok_flag = False
-			if (len(self.queue) == 1 and self.operators[0].busy == False):
-				ok_flag = True
-			if (log):
-				print("len queue: ", len(self.queue))
-				print(self.queue)
-				if (len(self.queue) > 0):
-					print(len(self.queue))
-					print(self.operators[0].busy)
-					for i in range(len(self.queue)):
-						print(self.queue[i].time)
-						self.queue[i].task.info()
-			if (self.count != 0 and (len(self.queue) == 0 or ok_flag)):
-				self.avg_waiting_time /= self.count
+						self.print_queue()
+				continue
+			i = 0
+			while i < self.operators_number and self.operators[i].busy:
+				i += 1
+			if (i == self.operators_number):
+				self.set_task_wait(event.task)
+				if (log):
+					print("\nTASK IS GOINT TO WAIT")
+					print(event.time)
+					event.task.info()
+					self.print_queue()
+				# the backlog is checked against the time left on every wait, the exact check runs only
+				# when the bound says the run can't drain and the line got twice as long as at the last one
+				if (len(self.waiting) >= self.next_check and self.start_bound(event.time) >= self.end_time):
+					if (self.cannot_drain(event.time)):
+						if (log):
+							print("\nQUEUE CAN'T DRAIN, RUN IS ABORTED AT", event.time)
+						self.status = 'unstable'
+						break
+					self.next_check = 2 * len(self.waiting)
 			else:
-				self.avg_waiting_time = -1
-			if (log):
-				print("avg", time, ": ", self.avg_waiting_time)
-			time += 1
-			if (self.avg_waiting_time == -1):
+				event = self.start_task(self.operators[i], event)
+				if (log):
+					print("\nTASK IS BEING PROCESSED")
+					print(event.time)
+					event.task.info()
+					self.print_queue()
+			cur_time = self.queue[0][0]
+		# the queue drained if at most one task is still waiting when the model time is over
+		if (log):
+			self.print_queue()
+			for task in self.waiting:
+				task.info()
+		if (self.stats is not None and self.status == 'stable'):
+			self.stats.change(self.end_time, 0, 0)
+		if (self.count != 0 and len(self.waiting) <= 1):
+			self.avg_waiting_time /= self.count
+			if (self.waits is not None):
+				self.avg_waiting_time = mser(self.waits)[0]
+			self.status = 'stable'
+		else:
+			self.avg_waiting_time = -1
+			self.status = 'unstable'
+		# control variates of the run, the same as Generator.controls gives the lockstep engine
+		self.controls = []
+		for gen in self.generators:
+			self.controls += [gen.time - self.start_time - (self.arrived[gen.id] + 1) * gen.arrive_mean, self.arrived_work[gen.id] - self.arrived[gen.id] * gen.operate_mean]
+		return self.avg_waiting_time
+
+	# average waiting times of several runs at once, -1 for the runs where the queue did not drain
+	# streams[run][generator] is the pair of random streams of the generator in that run
+	def lockstep_modeling(self, streams):
+		# the statistics of the runs need the waiting times of all the rows
+		arrive_times, operate_times, wait_times, arrived, served = self.lockstep_waits(streams, self.end_time, not self.collect_statistics)
+		tasks = arrive_times.shape[1]
+		count = served.sum(axis = 1)
+		waiting = arrived.sum(axis = 1) - count
+		# cumulative sum adds the waiting times one by one, so a row gives the same total in any batch of runs
+		total = numpy.zeros(len(count))
+		if (tasks > 0):
+			total = numpy.cumsum(numpy.where(served, wait_times, 0), axis = 1)[:, -1]
+		drained = (count != 0) & (waiting <= 1)
+		self.count = count.sum()
+		if (self.collect_statistics):
+			self.lockstep_statistics = self.statistics_rows(arrive_times, operate_times, wait_times, arrived, served)
+		avg = numpy.where(drained, total / numpy.maximum(count, 1), -1)
+		if (self.truncate_warmup):
+			for run in numpy.flatnonzero(drained):
+				avg[run] = mser(wait_times[run, served[run]])[0]
+		return avg.tolist()
+
+	# tasks of the runs sorted by arrival, one row per run, with their waiting times,
+	# which of them arrived before end_time and which of them started before end_time
+	# lockstep_controls gets the control variates of the runs (Generator.controls)
+	# with drain_check the rows that cannot drain get no waiting times and no served tasks
+	def lockstep_waits(self, streams, end_time, drain_check = False):
+		streams = [self.generators[i].generate_streams([run[i] for run in streams], end_time) for i in range(self.generators_number)]
+		self.lockstep_controls = numpy.hstack([self.generators[i].controls(*streams[i], end_time) for i in range(self.generators_number)])
+		arrive_times = numpy.hstack([stream[0] for stream in streams])
+		operate_times = numpy.hstack([stream[1] for stream in streams])
+		order = numpy.argsort(arrive_times, axis = 1, kind = 'stable')
+		arrive_times = numpy.take_along_axis(arrive_times, order, axis = 1)
+		operate_times = numpy.take_along_axis(operate_times, order, axis = 1)
+		arrived = arrive_times < end_time
+		# tasks after end_time are sorted to the end of the rows and don't change earlier waiting times
+		tasks = arrived.sum(axis = 1).max()
+		arrive_times = arrive_times[:, :tasks]
+		operate_times = operate_times[:, :tasks]
+		arrived = arrived[:, :tasks]
+
+		# the same test as start_bound: the operators can't start before the first arrival, so the last but one
+		# task that arrived can't start before it plus (the work in line before it - (operators - 1) * the longest
+		# operate time) / operators. If that is not before end_time at least two tasks are still waiting (cannot_drain)
+		hopeful = numpy.ones(len(arrive_times), dtype = bool)
+		if (drain_check and tasks > 1):
+			count = arrived.sum(axis = 1)
+			work = numpy.cumsum(numpy.where(arrived, operate_times, 0), axis = 1) - operate_times
+			work = numpy.take_along_axis(work, numpy.maximum(count - 2, 0)[:, None], axis = 1)[:, 0]
+			bound = arrive_times[:, 0] + (work - (self.operators_number - 1) * self.max_operate_time) / self.operators_number
+			hopeful = (count < 2) | (bound < end_time)
+
+		wait_times = numpy.zeros(arrive_times.shape)
+		if (hopeful.all()):
+			wait_times = self.wait_rows(arrive_times, operate_times)
+		elif (hopeful.any()):
+			wait_times[hopeful] = self.wait_rows(arrive_times[hopeful], operate_times[hopeful])
+		served = arrived & (arrive_times + wait_times < end_time) & hopeful[:, None]
+		return arrive_times, operate_times, wait_times, arrived, served
+
+	def wait_rows(self, arrive_times, operate_times):
+		if (self.operators_number == 1):
+			return lindley(arrive_times, operate_times)
+		return kiefer_wolfowitz(arrive_times, operate_times, self.operators_number)
+
+	# Statistics of every run from the arrays of lockstep_modeling, waiting times are added in the order
+	# the event engine adds them. A task waits in line from its arrival until it starts or end_time
+	# and an operator is busy from the start of a task until it is done or end_time
+	def statistics_rows(self, arrive_times, operate_times, wait_times, arrived, served):
+		start_times = arrive_times + wait_times
+		queue_area = numpy.where(arrived, numpy.minimum(start_times, self.end_time) - arrive_times, 0).sum(axis = 1).tolist()
+		busy_area = numpy.where(served, numpy.minimum(operate_times, self.end_time - start_times), 0).sum(axis = 1).tolist()
+		rows = []
+		for run in range(len(arrive_times)):
+			stats = Statistics(self.start_time, self.operators_number)
+			for wait in wait_times[run, served[run]].tolist():
+				stats.add_wait(wait)
+			stats.queue_area = queue_area[run]
+			stats.busy_area = busy_area[run]
+			stats.time = self.end_time
+			rows.append(stats)
+		return rows
+
+	# average waiting times of the runs, -1 for the runs where the queue did not drain
+	# statuses gets 'stable' or 'unstable' for every run and run_statistics their Statistics if they are collected
+	# with workers > 1 the runs are split over a process pool, the result is the same as with one worker
+	# with antithetic every value is the mean of a pair of runs with the same seed driven by U and 1 - U,
+	# -1 if any of them did not drain, run_statistics then has the Statistics of both runs of every pair
+	# run_controls gets the control variates of every value
+	# with cache the runs are looked up there first, statistics are not cached so runs that collect them are always made
+	def replicate(self, times, log = 0, workers = 1, antithetic = False):
+		if (self.engine == 'analytic'):
+			avg = [float(analytic_wait([[gen.sigma, gen.a, gen.b] for gen in self.generators], self.operators_number))] * times
+			self.run_statistics = []
+			self.run_controls = [[0] * 2 * self.generators_number] * times
+			self.statuses = ['unstable' if value == -1 else 'stable' for value in avg]
+			return avg
+		results = None
+		if (self.cache is not None and not self.collect_statistics):
+			results = self.result_cache()
+			params = self.cache_params(times, antithetic)
+			stored = results.get(params)
+			if (stored is not None):
+				# the seeds of the stored runs are spawned anyway, so the next call gets the same seeds as without cache
+				self.seed_sequence.spawn(times)
+				self.run_statistics = []
+				self.run_controls = stored["controls"]
+				self.statuses = ['unstable' if value == -1 else 'stable' for value in stored["avg"]]
+				return stored["avg"]
+		seeds = self.seed_sequence.spawn(times)
+		size = math.ceil(times / max(workers, 1))
+		chunks = pool_map(self.run_replications, [(seeds[i:i + size], log, antithetic) for i in range(0, times, size)], workers)
+		avg = [value for chunk in chunks for value in chunk[0]]
+		self.run_statistics = [stats for chunk in chunks for stats in chunk[1]]
+		self.run_controls = [controls for chunk in chunks for controls in chunk[2]]
+		self.statuses = ['unstable' if value == -1 else 'stable' for value in avg]
+		if (results is not None):
+			results.put(params, {"avg": avg, "controls": self.run_controls})
+		return avg
+
+	# the Cache of the model is opened by its first lookup and kept for the next ones
+	def result_cache(self):
+		if (self.results_cache is None):
+			self.results_cache = cache.Cache(self.cache)
+		return self.results_cache
+
+	# the sqlite connection of the cache can't be pickled, copies of the model sent to the processes
+	# of pool_map only make runs and don't use it
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["results_cache"] = None
+		return state
+
+	# everything the runs of replicate depend on, the seed with the number of seeds it already spawned
+	def cache_params(self, times, antithetic):
+		seed = self.seed_sequence
+		return {
+			"version": CACHE_VERSION,
+			"engine": self.engine,
+			"generators": [[gen.sigma, gen.a, gen.b] for gen in self.generators],
+			"operators": self.operators_number,
+			"start_time": self.start_time,
+			"end_time": self.end_time,
+			"truncate_warmup": self.truncate_warmup,
+			"times": times,
+			"antithetic": antithetic,
+			"seed": [seed.entropy, list(seed.spawn_key), seed.pool_size, seed.n_children_spawned]
+		}
+
+	# average waiting times, statistics and control variates of the runs
+	def run_replications(self, seeds, log = 0, antithetic = False):
+		runs = [(seed, None) for seed in seeds]
+		if (antithetic):
+			runs = [(seed_copy(seed), inverse) for seed in seeds for inverse in (False, True)]
+		if (self.engine == 'lockstep'):
+			avg = self.lockstep_modeling([self.generator_streams(seed, inverse) for seed, inverse in runs])
+			statistics = self.lockstep_statistics if self.collect_statistics else []
+			controls = self.lockstep_controls.tolist()
+			self.reset()
+		else:
+			avg = []
+			statistics = []
+			controls = []
+			for time in range(len(runs)):
+				self.seed_streams(*runs[time])
+				self.modeling(log)
+				if (log):
+					print("avg", time, ": ", self.avg_waiting_time)
+					if (self.stats is not None):
+						self.stats.info(self.end_time)
+				avg.append(self.avg_waiting_time)
+				if (self.stats is not None):
+					statistics.append(self.stats)
+				controls.append(self.controls)
+				self.reset()
+		if (antithetic):
+			avg = [-1 if -1 in avg[i:i + 2] else (avg[i] + avg[i + 1]) / 2 for i in range(0, len(avg), 2)]
+			controls = [[(a + b) / 2 for a, b in zip(controls[i], controls[i + 1])] for i in range(0, len(controls), 2)]
+		return avg, statistics, controls
+
+	def calculate(self, times, log = 0, workers = 1):
+		avg = 0
+		for value in self.replicate(times, log, workers):
+			if (value == -1):
 				avg = -1
 			else:
-				avg += self.avg_waiting_time
-			self.reset()
+				avg += value
 		return avg / times
 
-	def array_calculate(self, times, log = 0):
-		avg = []
-		for time in range(times):
-			for gen in self.generators:
-				task = gen.generate_new_task()
-				event = Event(task.arrive_time, task)
-				if (task.arrive_time < self.end_time):
-					self.add_event(event)
-					if (log):
-						print("\nGENERATE FIRST TASKS")
-						print(event.time)
-						task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-			cur_time = self.start_time
-			while (cur_time < self.end_time and len(self.queue) > 0):
-				if (log):
-					print("\nCUR TIME", cur_time)
-				event = self.get_event()
-				cur_time = event.time
-				if (cur_time > self.end_time):
-					break
-				if (log):
-					print("\nPOPPED EVENT")
-					print(event.time)
-					print("len queue: ", len(self.queue))
-					print(self.queue)
-					event.task.info()
-				if (event.task.status == 'new'):
-					gen_id = event.task.gen_id
-					new_task = self.generators[gen_id].generate_new_task()
-					new_event = Event(new_task.arrive_time, new_task)
-					if (new_task.arrive_time < self.end_time):
-						self.add_event(new_event)
-						if (log):
-							print("\nGENERATE NEW TASK")
-							print(new_event.time)
-							new_task.info()
-							print("len queue: ", len(self.queue))
-							print(self.queue)
-				if (event.task.status == 'done'):
-					if (log):
-						print("\nPOPPED TASK IS DONE")
-						print(event.time)
-						event.task.info()
-					self.operators[event.task.op_id].busy = False
-					continue
-				i = 0
-				while i < self.operators_number and self.operators[i].busy:
-					i += 1
-				if (i == self.operators_number):
-					self.set_task_wait(event.task)
-					if (log):
-						print("\nTASK IS GOINT TO WAIT")
-						print(event.time)
-						event.task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-				else:
-					event = self.operators[i].operate(event)
-					self.avg_waiting_time += event.task.wait_time
-					self.count += 1
-					self.add_event(event)
-					if (log):
-						print("\nTASK IS BEING PROCESSED")
-						print(event.time)
-						event.task.info()
-						print("len queue: ", len(self.queue))
-						print(self.queue)
-				cur_time = self.queue[0].time
-			while (len(self.queue) > 0):
-				if (self.queue[0].task.status == 'done'):
-					if (log):
-						print("\nPOPPING DONE TASKS AFTER MODEL TIME")
-					event = self.queue.pop(0)
-					self.operators[event.task.op_id].busy = False
-				else:
+	# values of array_calculate for batches of batch runs until the half width of the confidence interval
+	# of their mean gets below half_width or there are max_times of them.
+	# -1 of an unstable run is not a waiting time, so the batches stop as soon as a run is unstable
+	# with control_variates all the runs so far are adjusted together after every batch
+	def sequential_calculate(self, half_width, batch = 5, max_times = 100, confidence = 0.95, log = 0, workers = 1):
+		if (self.control_variates):
+			runs = []
+			controls = []
+			statuses = []
+			while (len(runs) < max_times):
+				runs += self.replicate(min(batch, max_times - len(runs)), log, workers)
+				controls += self.run_controls
+				statuses += self.statuses
+				avg = control_adjusted(runs, controls)
+				if ('unstable' in statuses or confidence_half_width(avg, confidence) <= half_width):
 					break
-			ok_flag = False
-			if (len(self.queue) == 1 and self.operators[0].busy == False):
-				ok_flag = True
-			if (log):
-				print("len queue: ", len(self.queue))
-				print(self.queue)
-				if (len(self.queue) > 0):
-					print(len(self.queue))
-					print(self.operators[0].busy)
-					for i in range(len(self.queue)):
-						print(self.queue[i].time)
-						self.queue[i].task.info()
-			if (self.count != 0 and (len(self.queue) == 0 or ok_flag)):
-				self.avg_waiting_time /= self.count
-			else:
-				self.avg_waiting_time = -1
-			if (log):
-				print("avg", time, ": ", self.avg_waiting_time)
-			time += 1
-			if (self.avg_waiting_time == -1):
+			self.statuses = statuses
+			return self.result_values(avg)
+		avg = []
+		while (len(avg) < max_times):
+			avg += self.array_calculate(min(batch, max_times - len(avg)), log, workers)
+			if ('unstable' in self.statuses or confidence_half_width(avg, confidence) <= half_width):
+				break
+		return avg
+
+	# batch means of the waiting times of one run of run_length instead of independent runs, the start
+	# transient is paid once. A few tasks left waiting at the end are normal for a long run, so the run
+	# is unstable (-1 for every batch) only if the operators got at least as much work as they could do.
+	# the run is made by the recursions of the lockstep engine whatever the engine, the event engine gives
+	# the same waiting times for the same streams. 'analytic' gives min_batches values of analytic_wait.
+	# with truncate_warmup the start transient found by mser is dropped before the waiting times are batched.
+	# control variates need independent runs, so they can't be used with it
+	def batch_calculate(self, run_length, batches = 32, max_correlation = 0.1, min_batches = 8):
+		assert(not self.control_variates)
+		if (self.engine == 'analytic'):
+			avg = self.replicate(min_batches)
+			return self.result_values(avg)
+		seed = self.seed_sequence.spawn(1)[0]
+		arrive_times, operate_times, wait_times, arrived, served = self.lockstep_waits([self.generator_streams(seed)], self.start_time + run_length)
+		if (served.sum() == 0 or operate_times[arrived].sum() >= self.operators_number * run_length):
+			self.statuses = ['unstable'] * min_batches
+			return self.result_values([-1] * min_batches)
+		waits = wait_times[0, served[0]]
+		if (self.truncate_warmup):
+			waits = waits[mser(waits)[1]:]
+		batch_means = BatchMeans(batches)
+		for wait in waits.tolist():
+			batch_means.add(wait)
+		avg = batch_means.means(max_correlation, min_batches)
+		self.statuses = ['stable'] * len(avg)
+		return self.result_values(avg)
+
+	def array_calculate(self, times, log = 0, workers = 1, antithetic = False):
+		avg = self.replicate(times, log, workers, antithetic)
+		if (self.control_variates):
+			avg = control_adjusted(avg, self.run_controls)
+		return self.result_values(avg)
+
+	def result_values(self, values):
+		avg = []
+		for value in values:
+			if (value == -1):
 				# avg.append(-1) infinity
 				avg.append(0)
 			else:
-				avg.append(self.avg_waiting_time)
-			self.reset()
+				avg.append(value)
+		unstable = self.statuses.count('unstable')
+		if (unstable > 0):
+			warnings.warn(str(unstable) + " of " + str(len(values)) + " runs are unstable, their waiting time is counted as 0")
 		return avg
 
 # x1 = 0.1
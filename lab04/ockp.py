@@ -1,7 +1,8 @@
-from model import Model
+from model import Model, pool_map, point_values, mean_runs, point_seed, analytic_wait, make_seed_sequence
 import random
 import numpy
 import math
+import os
 from prettytable import PrettyTable
 from itertools import combinations
 from scipy import stats
@@ -15,9 +16,31 @@ def get_prop(x_min, x_max, x):
 	return 2 * (x - x_min) / (x_max - x_min) - 1
 
 class OCKP:
-	def __init__ (self, min_max_params, times):
+	# every experiment gets its own random streams spawned from seed
+	# experiments are run on workers processes
+	# with half_width every experiment adds times runs at a time until the half width of the confidence
+	# interval of its y is below half_width or it has max_times runs
+	# with run_length every experiment is one run that long and its batch means stand for the runs
+	# with truncate_warmup every run drops its start transient before its waiting times are averaged
+	# with common_random_numbers run r of every experiment uses the same random streams
+	# with control_variates the runs are adjusted by the known means of interarrival and operate times
+	# cache is the path of the result cache (cache.Cache), experiments simulated before are taken from it
+	# with screen the analytic approximation of every experiment is printed before they are simulated
+	# the rows of the plan are not stored, they are made, simulated and printed block_size experiments at a time
+	def __init__ (self, min_max_params, times, seed = None, workers = 1, half_width = None, max_times = 100, run_length = None, truncate_warmup = False, common_random_numbers = False, control_variates = False, screen = False, cache = None, block_size = 4096):
 		self.min_max_params = min_max_params
 		self.times = times
+		self.replications = times
+		self.half_width = half_width
+		self.max_times = max_times
+		self.run_length = run_length
+		self.truncate_warmup = truncate_warmup
+		self.common_random_numbers = common_random_numbers
+		self.control_variates = control_variates
+		self.cache = cache
+		self.seed_sequence = make_seed_sequence(seed)
+		self.workers = workers
+		self.block_size = block_size
 		self.number_of_factors = len(min_max_params)
 		self.n = 2**self.number_of_factors
 		self.na = 2*self.number_of_factors
@@ -26,8 +49,6 @@ class OCKP:
 		self.doubles_count = int((self.number_of_factors) * (self.number_of_factors - 1)/2)
 		self.S = math.sqrt(self.n / self.number_of_experiments)
 		self.alpha = math.sqrt(self.n / 2 * (math.sqrt(self.number_of_experiments / self.n) - 1))
-		self.plantable = []
-		self.realtable = []
 		self.exp_data_filled = False
 		self.cal_data_filled = False
 		self.koef_count = 2 * self.number_of_factors + self.doubles_count + 1
@@ -39,11 +60,10 @@ class OCKP:
 		print("alpha = ", self.alpha)
 		print("--------------------------------")
 
-		self.form_plantable()
 		# self.show_plantable()
-
-		self.form_realtable()
 		# self.show_realtable()
+		if (screen):
+			self.analytic_screen()
 		self.fill_experiment_data()
 		# self.show_realtable()
 
@@ -55,54 +75,39 @@ class OCKP:
 
 		self.print_equation()
 
-	def form_plantable(self):
-		for experiment in range(self.n):
-			tablerow = []
-			for i in range(self.number_of_factors):
-				if (experiment & (1 << i)):
-					tablerow.append(-1)
-				else:
-					tablerow.append(1)
-			for i in range(1, self.number_of_factors):
-				for j in range(i + 1, self.number_of_factors + 1):
-					tablerow.append(tablerow[i-1] * tablerow[j-1])
-			for i in range(self.number_of_factors):
-				tablerow.append(1 - self.S)
-			self.plantable.append(tablerow)
-
-		for experiment in range(self.na):
-			tablerow = []
-			pos = math.floor(experiment / 2) + 1
-			for i in range(self.number_of_factors):
-				if (i < self.number_of_factors - pos):
-					tablerow.append(0)
-				elif (i == self.number_of_factors - pos):
-					if (experiment % 2 == 0):
-						tablerow.append(-self.alpha)
-					else:
-						tablerow.append(self.alpha)
-				else:
-					tablerow.append(0)
-			for i in range(1, self.number_of_factors):
-				for j in range(i + 1, self.number_of_factors + 1):
-					tablerow.append(tablerow[i-1] * tablerow[j-1])
-			for i in range(self.number_of_factors):
-				tablerow.append(tablerow[i]**2 - self.S)
-			self.plantable.append(tablerow)
-
-		tablerow = []
-		for i in range(self.number_of_factors):
-			tablerow.append(0)
-		for i in range(1, self.number_of_factors):
-			for j in range(i + 1, self.number_of_factors + 1):
-				tablerow.append(tablerow[i-1] * tablerow[j-1])
-		for i in range(self.number_of_factors):
-			tablerow.append(-self.S)
-		self.plantable.append(tablerow)
-
+	# coded values of the factors in experiments start..stop: the n corners of the cube (factor i is -1 in the
+	# ones with bit i set), then the na star points (factor k - 1 - e // 2 of star point e is -alpha for even e
+	# and alpha for odd e, the others are 0) and the center
+	def factor_rows(self, start, stop):
+		experiments = numpy.arange(start, stop)
+		rows = numpy.zeros((stop - start, self.number_of_factors))
+		corners = experiments < self.n
+		rows[corners] = 1 - 2 * ((experiments[corners, None] >> numpy.arange(self.number_of_factors)) & 1)
+		stars = numpy.flatnonzero((experiments >= self.n) & (experiments < self.n + self.na))
+		star = experiments[stars] - self.n
+		rows[stars, self.number_of_factors - 1 - star // 2] = numpy.where(star % 2 == 0, -self.alpha, self.alpha)
+		return rows
+
+	# columns of the regression of factor values x: x, the products of the pairs of x and x^2 - S
+	def regression_rows(self, x):
+		pairs = [x[:, i] * x[:, j] for i in range(self.number_of_factors - 1) for j in range(i + 1, self.number_of_factors)]
+		return numpy.column_stack([x] + pairs + [x**2 - self.S])
+
+	# rows of the plan of experiments start..stop
+	def plan_rows(self, start, stop):
+		return self.regression_rows(self.factor_rows(start, stop))
+
+	# rows of experiments start..stop in natural values of the factors
+	def real_rows(self, start, stop):
+		x_min = numpy.array([min_max[0] for min_max in self.min_max_params])
+		x_max = numpy.array([min_max[1] for min_max in self.min_max_params])
+		return self.regression_rows((self.factor_rows(start, stop) + 1) / 2 * (x_max - x_min) + x_min)
+
+	# (start, stop) of the blocks of experiments the plan is made, simulated and printed in
+	def blocks(self):
+		return [(start, min(start + self.block_size, self.number_of_experiments)) for start in range(0, self.number_of_experiments, self.block_size)]
 
 	def show_plantable(self):
-		pt = PrettyTable()
 		field_names = ['#']
 		for factor in range (self.number_of_factors + 1):
 			field_names.append('x' + str(factor))
@@ -114,34 +119,20 @@ class OCKP:
 		for factor in range (1, self.number_of_factors + 1):
 			field_names.append('x' + str(factor) + '^2 - S')
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.plantable:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			insertrow.insert(1, str(1))
-			pt.add_row(insertrow)
-			i += 1
-		print(pt)
-		# print(pt.get_string(fields=["x1","x1^2-S"]))
-
-
-	def form_realtable(self):
-		tablelen = len(self.plantable[0])
-		for experiment in range(self.number_of_experiments):
-			tablerow = []
-			for i in range(self.number_of_factors):
-				tablerow.append(get_value(self.plantable[experiment][i],self.min_max_params[i]))
-			for i in range(self.number_of_factors - 1):
-				for j in range(i + 1, self.number_of_factors):
-					tablerow.append(get_value(self.plantable[experiment][i],self.min_max_params[i]) * get_value(self.plantable[experiment][j],self.min_max_params[j]))
-			for i in range(self.number_of_factors):
-				tablerow.append(get_value(self.plantable[experiment][i],self.min_max_params[i])**2 - self.S)
-			self.realtable.append(tablerow)
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			i = start + 1
+			for row in self.plan_rows(start, stop).tolist():
+				row.insert(0, i)
+				row.insert(1, str(1))
+				pt.add_row(row)
+				i += 1
+			print(pt)
+			# print(pt.get_string(fields=["x1","x1^2-S"]))
 
 
 	def show_realtable(self):
-		pt = PrettyTable()
 		field_names = ['#']
 		for factor in range (1, self.number_of_factors + 1):
 			field_names.append('x' + str(factor))
@@ -154,60 +145,91 @@ class OCKP:
 			field_names.append('x' + str(factor) + '^2 - S')
 
 		if (self.exp_data_filled):
-			field_names.append('y_avg of ' + str(self.times) + ' times')
+			field_names.append('y_avg of ' + str(self.replications) + ' times')
 			field_names.append('disperssion')
 
 		if (self.cal_data_filled):
 			field_names.append('calculated_y')
 			field_names.append('y_diff')
 
-		pt.field_names = field_names
-		i = 1
-		for row in self.realtable:
-			insertrow = row.copy()
-			insertrow.insert(0, i)
-			pt.add_row(insertrow)
-			i += 1
-		# print(pt)
-		print(pt.get_string(fields=['y_avg of ' + str(self.times) + ' times', 'calculated_y', 'y_diff']))
-		# print(pt.get_string(fields=["x1","x1^2 - S"]))
-
+		for start, stop in self.blocks():
+			pt = PrettyTable()
+			pt.field_names = field_names
+			columns = []
+			if (self.exp_data_filled):
+				columns += [self.y_avg[start:stop], self.dispersion[start:stop]]
+			if (self.cal_data_filled):
+				columns += [self.y_calculated[start:stop], self.y_diff[start:stop]]
+			i = start + 1
+			for row in numpy.column_stack([self.real_rows(start, stop)] + columns).tolist():
+				row.insert(0, i)
+				pt.add_row(row)
+				i += 1
+			# print(pt)
+			print(pt.get_string(fields=['y_avg of ' + str(self.replications) + ' times', 'calculated_y', 'y_diff']))
+			# print(pt.get_string(fields=["x1","x1^2 - S"]))
+
+
+	# generators of the model in an experiment with natural values of the factors row (of real_rows)
+	def experiment_conf(self, row):
+		# change to fit model
+		x1 = row[0]
+		x2 = row[1]
+		x3 = row[2]
+		x4 = row[3]
+		x5 = row[4]
+		x6 = row[5]
+		##############
+		sigma1 =  1 / x1 * math.sqrt(2 / math.pi)
+		a1 = 1/x2 - x3 * math.sqrt(3)
+		b1 = 1/x2 + x3 * math.sqrt(3)
+		sigma2 =  1 / x4 * math.sqrt(2 / math.pi)
+		a2 = 1/x5 - x6 * math.sqrt(3)
+		b2 = 1/x5 + x6 * math.sqrt(3)
+		return [[sigma1, a1, b1], [sigma2, a2, b2]]
+
+	# analytic approximation of y in every experiment (analytic_wait), -1 where the operator is overloaded,
+	# the factor space can be screened with it before anything is simulated
+	def analytic_screen(self):
+		waits = []
+		for start, stop in self.blocks():
+			waits += [float(analytic_wait(self.experiment_conf(row))) for row in self.real_rows(start, stop).tolist()]
+		pt = PrettyTable()
+		pt.field_names = ['#', 'аналитическое y']
+		for exp in range(self.number_of_experiments):
+			pt.add_row([exp + 1, 'перегрузка' if waits[exp] == -1 else waits[exp]])
+		print(pt)
+		return waits
 
+	# every block of experiments is simulated on the workers before the next one is made, only the mean y,
+	# its dispersion and the number of runs of every experiment are kept
 	def fill_experiment_data(self):
 		self.exp_data_filled = True
 		sumdisppersion = 0
 		maxdispersion = 0
-		for exp in range(self.number_of_experiments):
-			# change to fit model
-			x1 = self.realtable[exp][0]
-			x2 = self.realtable[exp][1]
-			x3 = self.realtable[exp][2]
-			x4 = self.realtable[exp][3]
-			x5 = self.realtable[exp][4]
-			x6 = self.realtable[exp][5]
-			##############
-			sigma1 =  1 / x1 * math.sqrt(2 / math.pi)
-			a1 = 1/x2 - x3 * math.sqrt(3)
-			b1 = 1/x2 + x3 * math.sqrt(3)
-			sigma2 =  1 / x4 * math.sqrt(2 / math.pi)
-			a2 = 1/x5 - x6 * math.sqrt(3)
-			b2 = 1/x5 + x6 * math.sqrt(3)
-
-			model = Model(0, 20, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
-			#############################
-			y_arr = model.array_calculate(self.times)
-			y_avg = sum(y_arr)/self.times
-			self.realtable[exp].append(y_avg)
-			y_dispersion = sum([(y_avg - y_ex_value)**2 / self.times for y_ex_value in y_arr])
-			self.realtable[exp].append(y_dispersion)
-			if (y_dispersion > maxdispersion):
-				maxdispersion = y_dispersion
-			sumdisppersion += y_dispersion
+		self.y_avg = numpy.zeros(self.number_of_experiments)
+		self.dispersion = numpy.zeros(self.number_of_experiments)
+		self.run_counts = numpy.zeros(self.number_of_experiments, dtype = int)
+		for start, stop in self.blocks():
+			points = []
+			for exp, row in enumerate(self.real_rows(start, stop).tolist(), start):
+				points.append((0, 20, self.experiment_conf(row), 1, 'lockstep', point_seed(self.seed_sequence, exp, self.common_random_numbers), self.times, self.half_width, self.max_times, self.run_length, self.truncate_warmup, self.control_variates, self.cache))
+
+			for exp, y_arr in enumerate(pool_map(point_values, points, self.workers), start):
+				self.run_counts[exp] = len(y_arr)
+				y_avg = sum(y_arr)/len(y_arr)
+				self.y_avg[exp] = y_avg
+				y_dispersion = sum([(y_avg - y_ex_value)**2 / len(y_arr) for y_ex_value in y_arr])
+				self.dispersion[exp] = y_dispersion
+				if (y_dispersion > maxdispersion):
+					maxdispersion = y_dispersion
+				sumdisppersion += y_dispersion
 
 		self.Gp = maxdispersion / sumdisppersion
 		self.Sv = sumdisppersion / self.number_of_experiments
-		self.Sa = (self.S / self.number_of_experiments / self.times) ** 0.5
-		self.student_table = stats.t(df=(self.number_of_experiments * (self.times - 1))).ppf(0.95)
+		self.replications = mean_runs(self.run_counts.tolist())
+		self.Sa = (self.S / self.number_of_experiments / self.replications) ** 0.5
+		self.student_table = stats.t(df=(int(self.run_counts.sum()) - self.number_of_experiments)).ppf(0.95)
 		self.meaningful_koefs = 0
 
 
@@ -216,15 +238,19 @@ class OCKP:
 		a0 = 0
 		y_avg_index = int(2 * self.number_of_factors + self.number_of_factors * (self.number_of_factors - 1) / 2)
 		self.y_avg_index = y_avg_index
-		for exp in range(self.number_of_experiments):
-			a0 += self.realtable[exp][y_avg_index]
+		for y_avg in self.y_avg.tolist():
+			a0 += y_avg
 		a0 /= self.number_of_experiments
 		self.koefs.append(a0)
 
+		# sums of the columns of the plan times y_avg, a block of rows at a time
+		column_sums = numpy.zeros(y_avg_index)
+		for start, stop in self.blocks():
+			column_sums += self.y_avg[start:stop] @ self.plan_rows(start, stop)
+
 		koef_value = 0
 		for i in range(y_avg_index):
-			for exp in range(self.number_of_experiments):
-				koef_value += self.plantable[exp][i] * self.realtable[exp][y_avg_index]
+			koef_value += column_sums[i].item()
 			if (i < self.number_of_factors):
 				delim = self.n + 2 * self.alpha **2
 			elif (i < self.number_of_factors + self.number_of_factors * (self.number_of_factors - 1) / 2):
@@ -264,17 +290,19 @@ class OCKP:
 
 	def fill_calculated_data(self):
 		self.cal_data_filled = True
-		for exp in range(self.number_of_experiments):
-			y = self.koefs[0]
+		# y of the regression in all the rows of a block at once, adding the terms in the same order
+		self.y_calculated = numpy.zeros(self.number_of_experiments)
+		for start, stop in self.blocks():
+			plan = self.plan_rows(start, stop)
+			y = numpy.full(stop - start, float(self.koefs[0]))
 			for i in range(1, len(self.koefs)):
-				y += self.koefs[i] * self.plantable[exp][i-1]
-			y_diff = y - self.realtable[exp][self.y_avg_index]
-			self.realtable[exp].append(y)
-			self.realtable[exp].append(y_diff)
+				y += self.koefs[i] * plan[:, i-1]
+			self.y_calculated[start:stop] = y
+		self.y_diff = self.y_calculated - self.y_avg
 
 		sumsquarediffs = 0
-		for exp in range(self.number_of_experiments):
-			sumsquarediffs += self.realtable[exp][self.y_avg_index + 2]
+		for y in self.y_calculated.tolist():
+			sumsquarediffs += y
 		self.Sad = self.number_of_factors / (self.number_of_experiments - self.meaningful_koefs) * sumsquarediffs
 		self.F = self.Sad / self.Sv
 
@@ -351,7 +379,7 @@ def getdotbyprop(ockp):
 	a2 = 1/x5 - x6 * math.sqrt(3)
 	b2 = 1/x5 + x6 * math.sqrt(3)
 
-	model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1)
+	model = Model(0, 100, [[sigma1, a1, b1], [sigma2, a2, b2]], 1, 'lockstep')
 	y_avg = model.calculate(5)
 	y_cal = ockp.calculate([x1_prop, x2_prop, x3_prop, x4_prop, x5_prop, x6_prop])
 
@@ -362,32 +390,33 @@ def getdotbyprop(ockp):
 	print("Разница:\t\t\t\t", y_avg - y_cal)
 
 
-x1_min = 0.1
-x1_max = 0.2
+if __name__ == "__main__":
+	x1_min = 0.1
+	x1_max = 0.2
 
-x2_min = 0.7
-x2_max = 0.8
+	x2_min = 0.7
+	x2_max = 0.8
 
-x3_min = 0.03
-x3_max = 0.1
+	x3_min = 0.03
+	x3_max = 0.1
 
-x4_min = 0.125
-x4_max = 0.4
+	x4_min = 0.125
+	x4_max = 0.4
 
-x5_min = 0.9
-x5_max = 1.1
+	x5_min = 0.9
+	x5_max = 1.1
 
-x6_min = 0.05
-x6_max = 0.15
+	x6_min = 0.05
+	x6_max = 0.15
 
-times = 5
-min_max_factors = [[x1_min, x1_max], [x2_min, x2_max], [x3_min, x3_max], [x4_min, x4_max], [x5_min, x5_max], [x6_min, x6_max]]
-ockp = OCKP(min_max_factors, times)
+	times = 5
+	min_max_factors = [[x1_min, x1_max], [x2_min, x2_max], [x3_min, x3_max], [x4_min, x4_max], [x5_min, x5_max], [x6_min, x6_max]]
+	ockp = OCKP(min_max_factors, times, workers = os.cpu_count())
 
-getdotflag = True
-while (getdotflag):
-	flag = input('Рассчитать значение для точки из факторного пространства (ДA/нет)?')
-	if (flag == '' or flag.lower() == 'да'):
-		getdotbyprop(ockp)
-	elif (flag.lower() == 'нет'):
-		getdotflag = False
+	getdotflag = True
+	while (getdotflag):
+		flag = input('Рассчитать значение для точки из факторного пространства (ДA/нет)?')
+		if (flag == '' or flag.lower() == 'да'):
+			getdotbyprop(ockp)
+		elif (flag.lower() == 'нет'):
+			getdotflag = False